@@ -0,0 +1,80 @@
+"""
+Benchmark des ventes par seconde avec et sans group commit, 200 clients concurrents.
+
+- "direct" : chaque vente appelle database.record_sale, comme le fait /sales/confirm
+  par défaut (une transaction et un fsync par vente).
+- "group commit" : les ventes passent par core.group_commit.GroupCommitWriter,
+  qui les regroupe dans une transaction par fenêtre.
+
+Usage : python benchmarks/bench_group_commit.py [ventes_par_client]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from core.group_commit import GroupCommitWriter
+
+CLIENTS = 200
+USER_ID = "bench_user"
+PRODUCTS = [f"Produit {i}" for i in range(50)]
+
+
+def setup_db(path: str):
+    database.DB_NAME = path
+    database.init_db()
+    for name in PRODUCTS:
+        database.add_product(USER_ID, name, 500, 1_000_000)
+
+
+async def run_clients(sell, sales_per_client: int):
+    async def client(n: int):
+        ok = 0
+        for i in range(sales_per_client):
+            items = [{"name": PRODUCTS[(n + i) % len(PRODUCTS)], "quantity": 1}]
+            success, _, _ = await sell(items)
+            ok += success
+        return ok
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client(n) for n in range(CLIENTS)))
+    return sum(results), time.perf_counter() - start
+
+
+async def direct(items):
+    # Same as the async endpoint today: the sale runs on the event loop
+    return database.record_sale(USER_ID, items)
+
+
+def report(label: str, ok: int, elapsed: float, total: int):
+    print(f"{label:<28} {ok / elapsed:9.0f} ventes/s   ({ok}/{total} réussies en {elapsed:.2f} s)")
+
+
+def main():
+    sales_per_client = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    total = CLIENTS * sales_per_client
+    print(f"{CLIENTS} clients concurrents, {sales_per_client} ventes chacun\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_db(os.path.join(tmp, "direct.db"))
+        ok, elapsed = asyncio.run(run_clients(direct, sales_per_client))
+        report("Direct (1 transaction/vente)", ok, elapsed, total)
+
+        setup_db(os.path.join(tmp, "group.db"))
+        for window_ms in (2, 5, 20):
+            async def grouped():
+                writer = GroupCommitWriter(window_ms=window_ms, max_batch=200)
+                result = await run_clients(lambda items: writer.record_sale(USER_ID, items), sales_per_client)
+                await writer.stop()
+                return result
+
+            ok, elapsed = asyncio.run(grouped())
+            report(f"Group commit ({window_ms} ms)", ok, elapsed, total)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark des requêtes /products sur un inventaire de 100 000 produits.
+
+Compare l'ancien chemin (tout charger puis filtrer en Python, comme le faisait
+static/app.js) avec la recherche FTS5 et la pagination par curseur côté serveur.
+
+Usage : python benchmarks/bench_products_query.py [nombre_de_produits]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from models import CATEGORIES, UNITS, LOW_STOCK_THRESHOLD
+
+USER_ID = "bench_user"
+WORDS = ["riz", "huile", "savon", "lait", "sucre", "farine", "pagne", "tomate",
+         "sardine", "biscuit", "parfum", "crème", "café", "thé", "pâtes", "sel"]
+
+
+def populate(n: int):
+    rng = random.Random(42)
+    conn = sqlite3.connect(database.DB_NAME)
+    rows = []
+    for i in range(n):
+        name = f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} {i}"
+        price = rng.randint(1, 500) * 50
+        qty = rng.randint(0, 200)
+        rows.append((USER_ID, name, rng.choice(CATEGORIES), rng.choice(UNITS),
+                     price, qty, str(6100000000000 + i), None, price * qty))
+    conn.executemany('''
+        INSERT INTO products (user_id, name, category, unit, price, quantity, barcode, description, total_value)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def bench(label: str, fn, repeat: int = 5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    best = min(timings) * 1000
+    print(f"{label:<55} {best:9.2f} ms  ({len(result)} lignes)")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+        populate(n)
+        print(f"Inventaire : {n} produits\n")
+
+        def client_side_search():
+            term = "sardine"
+            return [p for p in database.get_all_products(USER_ID) if term in p.name.lower()]
+
+        def client_side_low_stock():
+            return [p for p in database.get_all_products(USER_ID) if p.quantity < LOW_STOCK_THRESHOLD]
+
+        def walk_pages(sort):
+            def run():
+                seen, cursor = [], None
+                for _ in range(10):
+                    page = database.get_all_products(USER_ID, sort=sort, limit=50, after=cursor)
+                    seen.extend(page)
+                    if len(page) < 50:
+                        break
+                    cursor = database.encode_cursor(page[-1], sort)
+                return seen
+            return run
+
+        bench("Tout charger + recherche en Python", client_side_search, repeat=3)
+        bench("Recherche FTS5 'sard' (tous résultats)",
+              lambda: database.get_all_products(USER_ID, search="sard"))
+        bench("Recherche FTS5 'sard' (50 premiers, tri par nom)",
+              lambda: database.get_all_products(USER_ID, search="sard", sort="name", limit=50))
+        bench("Recherche par code-barres '6100000099'",
+              lambda: database.get_all_products(USER_ID, search="6100000099"))
+        bench("Tout charger + stock bas en Python", client_side_low_stock, repeat=3)
+        bench("Filtre stock bas (SQL)",
+              lambda: database.get_all_products(USER_ID, low_stock=True))
+        bench("Filtre catégorie + unité, 50 premiers",
+              lambda: database.get_all_products(USER_ID, category="alimentation", unit="Sac", limit=50))
+        bench("10 pages de 50, tri par nom (curseur)", walk_pages("name"))
+        bench("10 pages de 50, tri par prix décroissant (curseur)", walk_pages("-price"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Coût CPU par requête de GET /products sur 10 000 produits.
+
+Compare l'ancien chemin (modèles Product construits ligne par ligne, revalidés par
+response_model puis encodés avec json) au chemin rapide (dicts lus directement
+depuis le curseur, encodés sans revalidation par orjson / MessagePack,
+compressés en gzip ou brotli).
+
+Usage : python benchmarks/bench_serialization.py [nombre_de_produits]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Header
+from fastapi.testclient import TestClient
+
+import database
+from models import Product
+
+USER_ID = "bench_user"
+REQUESTS = 20
+
+
+def populate(n: int):
+    conn = sqlite3.connect(database.DB_NAME)
+    conn.executemany('''
+        INSERT INTO products (user_id, name, category, unit, price, quantity, barcode, description, total_value)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(USER_ID, f"Produit {i}", "alimentation", "Sac", 12500.0, i % 200,
+           str(6100000000000 + i), "Sac de 50kg", 12500.0 * (i % 200)) for i in range(n)])
+    conn.commit()
+    conn.close()
+
+
+def legacy_app() -> FastAPI:
+    """GET /products as it was: models row by row, then response_model validation."""
+    app = FastAPI()
+
+    def rows_as_models(user_id: str) -> List[Product]:
+        conn = sqlite3.connect(database.DB_NAME)
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute("SELECT * FROM products WHERE user_id = ?", (user_id,)).fetchall()
+        conn.close()
+        return [Product(id=r["id"], name=r["name"], category=r["category"], unit=r["unit"],
+                        price=r["price"], quantity=r["quantity"], barcode=r["barcode"],
+                        description=r["description"], total_value=r["total_value"],
+                        min_stock=r["min_stock"]) for r in rows]
+
+    @app.get("/products", response_model=List[Product])
+    async def get_products(x_user_id: str = Header(...)):
+        return rows_as_models(x_user_id)
+
+    return app
+
+
+def bench(label: str, client: TestClient, headers: dict):
+    client.get("/products", headers=headers)  # warm-up
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    size = 0
+    for _ in range(REQUESTS):
+        response = client.get("/products", headers=headers)
+        size = len(response.content) if "Content-Encoding" not in response.headers else int(response.headers["Content-Length"])
+    cpu = (time.process_time() - cpu_start) / REQUESTS * 1000
+    wall = (time.perf_counter() - wall_start) / REQUESTS * 1000
+    print(f"{label:<40} CPU {cpu:7.1f} ms/req   total {wall:7.1f} ms/req   {size / 1024:7.0f} Ko")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        database.init_db()
+        populate(n)
+        print(f"Inventaire : {n} produits, {REQUESTS} requêtes par cas\n")
+
+        # Imported once DB_NAME points at the temporary DB: main.py runs init_db() on import
+        from main import app
+        headers = {"X-User-ID": USER_ID}
+        legacy, fast = TestClient(legacy_app()), TestClient(app)
+
+        bench("Ancien chemin (Pydantic + json)", legacy, dict(headers, **{"Accept-Encoding": "identity"}))
+        bench("Chemin rapide (orjson)", fast, dict(headers, **{"Accept-Encoding": "identity"}))
+        bench("Chemin rapide (MessagePack)", fast, dict(headers, **{"Accept-Encoding": "identity", "Accept": "application/msgpack"}))
+        bench("Chemin rapide (orjson + gzip)", fast, dict(headers, **{"Accept-Encoding": "gzip"}))
+        bench("Chemin rapide (orjson + brotli)", fast, dict(headers, **{"Accept-Encoding": "br"}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+# Events kept per user so a reconnecting client can resume with Last-Event-ID
+REPLAY_BUFFER_SIZE = 500
+# Pending events per subscriber before it is considered too slow and dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+# A user's replay buffer is dropped once nobody listens and nothing was published for this long
+BUFFER_IDLE_SECONDS = 3600.0
+# Idle delay before sending an SSE comment to keep proxies from closing the stream
+HEARTBEAT_SECONDS = 15.0
+
+
+class Subscriber:
+    def __init__(self, user_id: str, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+    def deliver(self, event: Optional[Dict[str, Any]]):
+        """Queue an event; a full queue drops the subscriber (None ends its stream)."""
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class EventHub:
+    """
+    In-process pub/sub for inventory changes, one channel per user.
+
+    Event ids look like "<boot>-<seq>": a client resuming with an id from a previous
+    process (or older than the replay buffer) receives a "reset" event instead and
+    must reload its data.
+
+    Buffers of users without subscribers are dropped after `buffer_idle` seconds
+    without events. Only the seq of the newest dropped event is kept for the user:
+    ids older than it get a reset too.
+    """
+
+    def __init__(self, buffer_size: int = REPLAY_BUFFER_SIZE, queue_size: int = SUBSCRIBER_QUEUE_SIZE,
+                 buffer_idle: float = BUFFER_IDLE_SECONDS):
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.buffer_idle = buffer_idle
+        self.boot = str(int(time.time() * 1000))
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+        self._buffers: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._evicted: Dict[str, int] = {}  # seq of the last event pushed out of (or dropped with) each buffer
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._next_sweep = time.monotonic() + buffer_idle
+
+    def publish(self, user_id: str, event_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Record an event and push it to the user's subscribers. Safe to call from any thread."""
+        with self._lock:
+            seq = next(self._seq)
+            now = time.monotonic()
+            event = {"id": f"{self.boot}-{seq}", "seq": seq, "type": event_type, "data": data, "time": now}
+            if now >= self._next_sweep:
+                self._sweep(now)
+            buffer = self._buffers.setdefault(user_id, deque(maxlen=self.buffer_size))
+            if len(buffer) == buffer.maxlen:
+                self._evicted[user_id] = buffer[0]["seq"]
+            buffer.append(event)
+            subscribers = list(self._subscribers.get(user_id, []))
+
+        try:
+            current_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            current_loop = None
+        for sub in subscribers:
+            if sub.loop is current_loop:
+                sub.deliver(event)
+            else:
+                sub.loop.call_soon_threadsafe(sub.deliver, event)
+        return event
+
+    def subscribe(self, user_id: str, last_event_id: Optional[str] = None) -> Tuple[Subscriber, Optional[List[Dict[str, Any]]]]:
+        """
+        Register a subscriber for the running event loop.
+        Returns it with the events to replay after `last_event_id`, or None when
+        they are no longer available and the client needs a reset.
+        """
+        sub = Subscriber(user_id, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, []).append(sub)
+            replay = self._events_after(user_id, last_event_id) if last_event_id else []
+        return sub, replay
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id, [])
+            if sub in subs:
+                subs.remove(sub)
+            if not subs:
+                self._subscribers.pop(sub.user_id, None)
+
+    def _sweep(self, now: float):
+        """Drop the buffers of users nobody listens to whose newest event is older than buffer_idle."""
+        self._next_sweep = now + self.buffer_idle
+        for user_id, buffer in list(self._buffers.items()):
+            if user_id not in self._subscribers and buffer[-1]["time"] < now - self.buffer_idle:
+                self._evicted[user_id] = buffer[-1]["seq"]
+                del self._buffers[user_id]
+
+    def _events_after(self, user_id: str, last_event_id: str) -> Optional[List[Dict[str, Any]]]:
+        boot, _, seq = last_event_id.partition("-")
+        if boot != self.boot or not seq.isdigit():
+            return None
+        last_seq = int(seq)
+        if last_seq < self._evicted.get(user_id, 0):
+            return None
+        return [e for e in self._buffers.get(user_id, ()) if e["seq"] > last_seq]
+
+    async def stream(self, user_id: str, last_event_id: Optional[str] = None,
+                     heartbeat: float = HEARTBEAT_SECONDS) -> AsyncIterator[str]:
+        """Server-Sent Events stream for a user, ending when the subscriber is dropped."""
+        sub, replay = self.subscribe(user_id, last_event_id)
+        try:
+            yield "retry: 3000\n\n"
+            if replay is None:
+                yield format_sse({"id": self.latest_id(user_id), "type": "reset", "data": {}})
+            else:
+                for event in replay:
+                    yield format_sse(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    return
+                yield format_sse(event)
+        finally:
+            self.unsubscribe(sub)
+
+    def latest_id(self, user_id: str) -> str:
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            return buffer[-1]["id"] if buffer else f"{self.boot}-{self._evicted.get(user_id, 0)}"
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    data = json.dumps(event["data"], ensure_ascii=False, separators=(",", ":"))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+hub = EventHub()
@@ -0,0 +1,101 @@
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import database
+
+# Group commit is opt-in: GROUP_COMMIT=1 routes sales and stock updates through the writer
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT", "0") == "1"
+# Longest a mutation waits for others to join its transaction
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "5"))
+# Most mutations applied in one transaction
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "200"))
+
+
+class GroupCommitWriter:
+    """
+    Single writer draining a queue of sale and stock mutations.
+
+    Mutations arriving within the same short window are applied in one SQLite
+    transaction (one fsync) by database.apply_batch, in a worker thread. Each caller
+    gets back the result of its own mutation, exactly as if it had called
+    record_sale / add_product / add_products / remove_product directly.
+    """
+
+    def __init__(self, window_ms: float = GROUP_COMMIT_WINDOW_MS, max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        # Started lazily on the running loop (and restarted if the loop changed, e.g. in tests)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, kind: str, user_id: str, **kwargs) -> Any:
+        """Queue a mutation (see database.apply_batch for the kinds) and wait for its own result."""
+        self._ensure_started()
+        future = self._loop.create_future()
+        await self._queue.put((kind, user_id, kwargs, future))
+        result = await future
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def record_sale(self, user_id: str, items: List[Dict],
+                          idempotency: Optional[Dict] = None) -> Tuple[bool, str, float]:
+        return await self.submit("sale", user_id, items=items, idempotency=idempotency)
+
+    async def add_product(self, user_id: str, **kwargs):
+        return await self.submit("add", user_id, **kwargs)
+
+    async def add_products(self, user_id: str, products: List[Dict], idempotency: Optional[Dict] = None):
+        return await self.submit("add_many", user_id, products=products, idempotency=idempotency)
+
+    async def remove_product(self, user_id: str, name: str, quantity: int):
+        return await self.submit("remove", user_id, name=name, quantity=quantity)
+
+    async def _next_batch(self) -> List[Tuple]:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Whatever is already waiting joins too, up to the batch size
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            operations = [(kind, user_id, kwargs) for kind, user_id, kwargs, _ in batch]
+            try:
+                results = await self._loop.run_in_executor(None, database.apply_batch, operations)
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, _, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+writer = GroupCommitWriter()
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import database
+
+# How long a stored response can be replayed
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+# Most keys remembered per user (oldest are forgotten first)
+IDEMPOTENCY_MAX_KEYS_PER_USER = 1000
+# Delay between sweeps of expired keys of every user in memory
+IDEMPOTENCY_SWEEP_SECONDS = 600
+
+Response = Tuple[int, Any]  # (status_code, JSON body)
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a different request."""
+
+
+def fingerprint(*parts: bytes) -> str:
+    """Hash identifying a request payload, to detect a key reused for another request."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class _Entry:
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.response: Optional[Response] = None
+        self.waiter: Optional[asyncio.Future] = None
+
+
+class IdempotencyStore:
+    """
+    Per-user store of responses keyed by the client's Idempotency-Key.
+
+    Responses live in memory (bounded, with a TTL) and in SQLite so they survive a
+    restart. While the first request with a key is running, duplicates wait for its
+    result instead of running the handler again.
+
+    Expired keys are forgotten when the user stores a new one, and every
+    `sweep_interval` seconds for all users; users left without keys are dropped.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_SECONDS, max_keys: int = IDEMPOTENCY_MAX_KEYS_PER_USER,
+                 sweep_interval: float = IDEMPOTENCY_SWEEP_SECONDS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self._entries: Dict[str, "OrderedDict[str, _Entry]"] = {}
+        self._next_sweep = time.time() + sweep_interval
+
+    def record(self, user_id: str, key: str, request_fingerprint: str,
+               response: Callable[[Any], Optional[Response]]) -> Dict[str, Any]:
+        """
+        Record for a mutation that stores its own response in its SQLite transaction
+        (see database.record_sale / add_products): `response` maps the mutation's
+        result to the (status_code, body) returned, or None when nothing was written.
+        Pass it to run() as well so the response is not stored a second time.
+        """
+        return {"user_id": user_id, "key": key, "fingerprint": request_fingerprint,
+                "max_age": self.ttl, "max_keys": self.max_keys, "response": response, "saved": False}
+
+    async def run(self, user_id: str, key: str, request_fingerprint: str,
+                  handler: Callable[[], Awaitable[Response]],
+                  record: Optional[Dict[str, Any]] = None) -> Tuple[Response, bool]:
+        """
+        Run `handler` once per (user, key) and return (response, replayed).
+        Exceptions raised by the handler are not stored: the key can be retried.
+        Raises IdempotencyConflict when the key was used with another fingerprint.
+        """
+        now = time.time()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        entries = self._entries.setdefault(user_id, OrderedDict())
+        entry = entries.get(key)
+        if entry and entry.expires_at < now:
+            del entries[key]
+            entry = None
+
+        if entry is None:
+            stored = database.get_idempotency_record(user_id, key, self.ttl)
+            if stored:
+                entry = _Entry(stored["fingerprint"], stored["created_at"] + self.ttl)
+                entry.response = (stored["status_code"], stored["response"])
+                self._remember(entries, key, entry)
+
+        if entry is not None:
+            if entry.fingerprint != request_fingerprint:
+                raise IdempotencyConflict("Cette clé d'idempotence a déjà été utilisée pour une autre requête.")
+            if entry.response is None:
+                await asyncio.shield(entry.waiter)
+            entries.move_to_end(key)
+            return entry.response, True
+
+        entry = _Entry(request_fingerprint, now + self.ttl)
+        entry.waiter = asyncio.get_running_loop().create_future()
+        self._remember(entries, key, entry)
+        try:
+            response = await handler()
+        except asyncio.CancelledError:
+            self._forget(user_id, key)
+            entry.waiter.cancel()
+            raise
+        except Exception as e:
+            self._forget(user_id, key)
+            entry.waiter.set_exception(e)
+            entry.waiter.exception()  # Waiters re-raise it; don't warn when there are none
+            raise
+
+        entry.response = response
+        entry.waiter.set_result(response)
+        if not (record and record["saved"]):
+            database.save_idempotency_record(user_id, key, request_fingerprint, response[0], response[1],
+                                             self.ttl, self.max_keys)
+        return response, False
+
+    def _remember(self, entries: "OrderedDict[str, _Entry]", key: str, entry: _Entry):
+        entries[key] = entry
+        entries.move_to_end(key)
+        now = time.time()
+        while entries:
+            oldest_key, oldest = next(iter(entries.items()))
+            if oldest.response is None:
+                break  # Never forget a request that is still running
+            if len(entries) <= self.max_keys and oldest.expires_at >= now:
+                break
+            del entries[oldest_key]
+
+    def _forget(self, user_id: str, key: str):
+        entries = self._entries.get(user_id)
+        if entries is not None:
+            entries.pop(key, None)
+            if not entries:
+                del self._entries[user_id]
+
+    def _sweep(self, now: float):
+        """Drop every expired, completed key and the users left without keys."""
+        self._next_sweep = now + self.sweep_interval
+        for user_id, entries in list(self._entries.items()):
+            for key, entry in list(entries.items()):
+                if entry.response is not None and entry.expires_at < now:
+                    del entries[key]
+            if not entries:
+                del self._entries[user_id]
+
+
+idempotency = IdempotencyStore()
@@ -0,0 +1,74 @@
+import gzip
+import json
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+# Fast encoders are optional: fall back to the standard library when missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+# Smaller payloads are not worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+
+def dumps_json(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _accepts(header: str, token: str) -> bool:
+    """Whether `token` is listed in an Accept / Accept-Encoding header without q=0."""
+    for part in header.split(","):
+        value, _, params = part.strip().partition(";")
+        if value.strip().lower() == token:
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+def _negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    if brotli is not None and _accepts(accept_encoding, "br"):
+        return "br"
+    if _accepts(accept_encoding, "gzip"):
+        return "gzip"
+    return None
+
+
+def encode_response(request: Request, data: Any, status_code: int = 200,
+                    headers: Optional[dict] = None) -> Response:
+    """
+    Encode trusted, already JSON-compatible data (dicts/lists from the database)
+    without going through Pydantic again.
+
+    Negotiates MessagePack via `Accept` and gzip/brotli via `Accept-Encoding`.
+    """
+    accept = request.headers.get("accept", "")
+    msgpack_type = next((t for t in MSGPACK_TYPES if _accepts(accept, t)), None)
+    if msgpack is not None and msgpack_type:
+        body, media_type = msgpack.packb(data, use_bin_type=True), msgpack_type
+    else:
+        body, media_type = dumps_json(data), "application/json"
+
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept, Accept-Encoding"
+    encoding = _negotiate_encoding(request.headers.get("accept-encoding", "")) if len(body) >= COMPRESS_MIN_SIZE else None
+    if encoding == "br":
+        body = brotli.compress(body, quality=4)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=5)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
@@ -1,10 +1,56 @@
 import sqlite3
-from typing import List, Optional, Tuple, Dict
-from models import Product, ProductInput
-from datetime import datetime
+import base64
+import json
+import time
+from typing import List, Optional, Tuple, Dict, Any, Callable
+from models import Product, ProductInput, Alert, LOW_STOCK_THRESHOLD, ALERT_HYSTERESIS_PERCENT
+from datetime import datetime, timedelta
 
 DB_NAME = "inventory.db"
 
+# How long a synced offline operation is remembered, to detect it being sent again
+SYNC_RETENTION_DAYS = 30
+
+# Callbacks (user_id, event_type, data) run after a mutating transaction commits
+_change_listeners: List[Callable[[str, str, Dict], None]] = []
+
+# Columns returned for a product, in the order of the Product model fields
+PRODUCT_COLUMNS = ("id", "name", "category", "unit", "price", "quantity",
+                   "barcode", "description", "total_value", "min_stock")
+
+# Sort keys accepted by get_all_products, mapped to their SQL expression.
+# A leading "-" on the key means descending order; ties are broken by id.
+SORT_COLUMNS = {
+    "id": "id",
+    "name": "name COLLATE NOCASE",
+    "category": "category",
+    "price": "price",
+    "quantity": "quantity",
+    "total_value": "total_value",
+}
+
+def add_change_listener(listener: Callable[[str, str, Dict], None]):
+    """Be notified of committed changes: product_upserted, stock_changed, sale_recorded."""
+    _change_listeners.append(listener)
+
+def _notify(user_id: str, event_type: str, data: Dict):
+    for listener in _change_listeners:
+        try:
+            listener(user_id, event_type, data)
+        except Exception as e:
+            print(f"[DB] Change listener failed: {e}")
+
+def _notify_all(user_id: str, events: List[Tuple[str, Dict]]):
+    for event_type, data in events:
+        _notify(user_id, event_type, data)
+
+def _dict_factory(cursor, row) -> Dict:
+    # Plain dicts, ready to be serialized without going through sqlite3.Row
+    return dict(zip([c[0] for c in cursor.description], row))
+
+def _stock_change(product_id: int, name: str, quantity: int, total_value: float) -> Dict:
+    return {"id": product_id, "name": name, "quantity": quantity, "total_value": total_value}
+
 def init_db():
     conn = sqlite3.connect(DB_NAME)
     cursor = conn.cursor()
@@ -41,6 +87,7 @@ def init_db():
                 barcode TEXT,
                 description TEXT,
                 total_value REAL NOT NULL DEFAULT 0,
+                min_stock INTEGER,
                 UNIQUE(user_id, name)
             )
         ''')
@@ -48,7 +95,7 @@ def init_db():
         # 3. Migrate data
         # Mapping old columns to new ones. Handle missing user_id.
         old_cols = columns.keys()
-        cols_to_copy = [c for c in old_cols if c in ['id', 'name', 'category', 'unit', 'price', 'quantity', 'barcode', 'description', 'total_value', 'user_id']]
+        cols_to_copy = [c for c in old_cols if c in ['id', 'name', 'category', 'unit', 'price', 'quantity', 'barcode', 'description', 'total_value', 'user_id', 'min_stock']]
         cols_str = ", ".join(cols_to_copy)
         
         cursor.execute(f"INSERT INTO products ({cols_str}) SELECT {cols_str} FROM products_old")
@@ -70,9 +117,143 @@ def init_db():
                 barcode TEXT,
                 description TEXT,
                 total_value REAL NOT NULL DEFAULT 0,
+                min_stock INTEGER,
                 UNIQUE(user_id, name)
             )
         ''')
+        if columns and 'min_stock' not in columns:
+            # Seuil d'alerte par produit (NULL = seuil de la catégorie)
+            cursor.execute("ALTER TABLE products ADD COLUMN min_stock INTEGER")
+
+    # Index plein texte (FTS5) sur nom, description et code-barres.
+    # Table "external content" : les triggers la gardent synchronisée avec products.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='products_fts'")
+    fts_exists = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description, barcode,
+            content='products', content_rowid='id',
+            tokenize="unicode61 remove_diacritics 2"
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts(rowid, name, description, barcode)
+            VALUES (new.id, new.name, new.description, new.barcode);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, description, barcode)
+            VALUES ('delete', old.id, old.name, old.description, old.barcode);
+        END
+    ''')
+    # Only re-index when a searchable column actually changes (stock updates don't)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_au
+        AFTER UPDATE OF name, description, barcode ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name, description, barcode)
+            VALUES ('delete', old.id, old.name, old.description, old.barcode);
+            INSERT INTO products_fts(rowid, name, description, barcode)
+            VALUES (new.id, new.name, new.description, new.barcode);
+        END
+    ''')
+    if needs_migration or not fts_exists:
+        cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+    # Version de l'inventaire par utilisateur, incrémentée à chaque changement de produit
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_versions (
+            user_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for event, row in (("INSERT", "new"), ("UPDATE", "new"), ("DELETE", "old")):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS inventory_version_{event.lower()} AFTER {event} ON products BEGIN
+                INSERT INTO inventory_versions (user_id, version) VALUES ({row}.user_id, 1)
+                ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+            END
+        ''')
+
+    # Opérations synchronisées depuis le mode hors ligne (détection des doublons)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_operations (
+            user_id TEXT NOT NULL,
+            op_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            client_timestamp TEXT,
+            status TEXT NOT NULL,
+            message TEXT NOT NULL,
+            result TEXT,
+            synced_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, op_id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sync_operations_user_synced ON sync_operations(user_id, synced_at)")
+
+    # Index pour le tri et la pagination par curseur (keyset)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_user_name ON products(user_id, name COLLATE NOCASE, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_user_quantity ON products(user_id, quantity, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_user_price ON products(user_id, price, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_user_total_value ON products(user_id, total_value, id)")
+    # Also serves the category filter; replaces the former (user_id, category, unit) index
+    cursor.execute("DROP INDEX IF EXISTS idx_products_user_category")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_user_category_id ON products(user_id, category, id)")
+
+    # Seuils d'alerte par défaut, par catégorie
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS category_thresholds (
+            user_id TEXT NOT NULL,
+            category TEXT NOT NULL,
+            min_stock INTEGER NOT NULL,
+            PRIMARY KEY (user_id, category)
+        )
+    ''')
+
+    # Alertes de stock bas. Au plus une alerte ouverte par produit.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='alerts'")
+    alerts_exist = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            quantity INTEGER NOT NULL,
+            threshold INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_at TEXT NOT NULL,
+            resolved_at TEXT,
+            FOREIGN KEY(product_id) REFERENCES products(id)
+        )
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_open_product ON alerts(product_id) WHERE status = 'open'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alerts_open_user ON alerts(user_id, id) WHERE status = 'open'")
+    if not alerts_exist:
+        # Produits déjà sous leur seuil avant la création des alertes : même seuil que le filtre low_stock
+        cursor.execute('''
+            INSERT INTO alerts (user_id, product_id, product_name, quantity, threshold, created_at)
+            SELECT p.user_id, p.id, p.name, p.quantity,
+                   COALESCE(p.min_stock, ct.min_stock, ?), ?
+            FROM products p
+            LEFT JOIN category_thresholds ct ON ct.user_id = p.user_id AND ct.category = p.category
+            WHERE p.quantity < COALESCE(p.min_stock, ct.min_stock, ?)
+        ''', (LOW_STOCK_THRESHOLD, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), LOW_STOCK_THRESHOLD))
+
+    # Réponses enregistrées par clé d'idempotence (rejeu des requêtes répétées)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            status_code INTEGER NOT NULL,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (user_id, key)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_user_created ON idempotency_keys(user_id, created_at)")
 
     # Table des ventes
     cursor.execute('''
@@ -96,9 +277,45 @@ def init_db():
             FOREIGN KEY(sale_id) REFERENCES sales(id)
         )
     ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_user_date ON sales(user_id, date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sale ON sale_items(sale_id)")
     conn.commit()
     conn.close()
 
+def _rearm_level(threshold: int) -> int:
+    """Stock level at which an open alert is resolved (hysteresis above the threshold)."""
+    return threshold + max(1, threshold * ALERT_HYSTERESIS_PERCENT // 100)
+
+def _category_threshold(cursor, user_id: str, category: str) -> int:
+    cursor.execute("SELECT min_stock FROM category_thresholds WHERE user_id = ? AND category = ?",
+                   (user_id, category))
+    row = cursor.fetchone()
+    return row[0] if row else LOW_STOCK_THRESHOLD
+
+def _evaluate_stock_alert(cursor, user_id: str, product_id: int, name: str,
+                          category: str, quantity: int, min_stock: Optional[int]):
+    """
+    Open, refresh or resolve the alert of a single product after its stock changed.
+    Runs on the caller's cursor so it commits (or rolls back) with the stock update.
+    """
+    threshold = min_stock if min_stock is not None else _category_threshold(cursor, user_id, category)
+    cursor.execute("SELECT id FROM alerts WHERE product_id = ? AND status = 'open'", (product_id,))
+    open_alert = cursor.fetchone()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    if open_alert:
+        if quantity >= _rearm_level(threshold):
+            cursor.execute("UPDATE alerts SET status = 'resolved', quantity = ?, resolved_at = ? WHERE id = ?",
+                           (quantity, now, open_alert[0]))
+        else:
+            cursor.execute("UPDATE alerts SET quantity = ?, threshold = ? WHERE id = ?",
+                           (quantity, threshold, open_alert[0]))
+    elif quantity < threshold:
+        cursor.execute('''
+            INSERT INTO alerts (user_id, product_id, product_name, quantity, threshold, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, product_id, name, quantity, threshold, now))
+
 def get_product(user_id: str, name: str) -> Optional[Product]:
     conn = sqlite3.connect(DB_NAME)
     conn.row_factory = sqlite3.Row
@@ -117,17 +334,30 @@ def get_product(user_id: str, name: str) -> Optional[Product]:
             quantity=row["quantity"], 
             barcode=row["barcode"], 
             description=row["description"], 
-            total_value=row["total_value"]
+            total_value=row["total_value"],
+            min_stock=row["min_stock"]
         )
     return None
 
 def add_product(user_id: str, name: str, price: float, quantity: int, 
                 category: str = "autres", unit: str = "Unité",
-                barcode: str = None, description: str = None) -> Product:
+                barcode: str = None, description: str = None,
+                min_stock: Optional[int] = None) -> Product:
     conn = sqlite3.connect(DB_NAME)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
-    
+    events = []
+    product = _apply_add_product(cursor, events, user_id, name, price, quantity, category,
+                                 unit, barcode, description, min_stock)
+    conn.commit()
+    conn.close()
+    _notify_all(user_id, events)
+    return product
+
+def _apply_add_product(cursor, events: List, user_id: str, name: str, price: float, quantity: int,
+                       category: str = "autres", unit: str = "Unité",
+                       barcode: str = None, description: str = None,
+                       min_stock: Optional[int] = None) -> Product:
     # Clean input
     name = name.strip()
     
@@ -144,21 +374,22 @@ def add_product(user_id: str, name: str, price: float, quantity: int,
         new_total = new_price * new_qty
         new_barcode = barcode if barcode else existing["barcode"]
         new_desc = description if description else existing["description"]
+        new_min_stock = min_stock if min_stock is not None else existing["min_stock"]
         
         cursor.execute('''
             UPDATE products SET price = ?, quantity = ?, total_value = ?,
-            category = ?, unit = ?, barcode = ?, description = ?
+            category = ?, unit = ?, barcode = ?, description = ?, min_stock = ?
             WHERE id = ?
         ''', (new_price, new_qty, new_total, new_category, new_unit, 
-              new_barcode, new_desc, existing["id"]))
+              new_barcode, new_desc, new_min_stock, existing["id"]))
         product_id = existing["id"]
     else:
         # Insert
         total_value = price * quantity
         cursor.execute('''
-            INSERT INTO products (user_id, name, category, unit, price, quantity, barcode, description, total_value)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, name, category, unit, price, quantity, barcode, description, total_value))
+            INSERT INTO products (user_id, name, category, unit, price, quantity, barcode, description, total_value, min_stock)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, name, category, unit, price, quantity, barcode, description, total_value, min_stock))
         product_id = cursor.lastrowid
         new_qty = quantity
         new_price = price
@@ -167,20 +398,54 @@ def add_product(user_id: str, name: str, price: float, quantity: int,
         new_unit = unit
         new_barcode = barcode
         new_desc = description
-        
-    conn.commit()
-    conn.close()
+        new_min_stock = min_stock
+
+    stored_name = existing["name"] if existing else name
+    _evaluate_stock_alert(cursor, user_id, product_id, stored_name, new_category, new_qty, new_min_stock)
     
-    return Product(
-        id=product_id, name=name, category=new_category, unit=new_unit,
+    product = Product(
+        id=product_id, name=stored_name, category=new_category, unit=new_unit,
         price=new_price, quantity=new_qty, barcode=new_barcode,
-        description=new_desc, total_value=new_total
+        description=new_desc, total_value=new_total, min_stock=new_min_stock
     )
+    events.append(("product_upserted", product.model_dump()))
+    return product
+
+def add_products(user_id: str, products: List[Dict], idempotency: Optional[Dict] = None) -> List[Product]:
+    """Add or update several products (dicts of add_product arguments) in a single transaction."""
+    conn = sqlite3.connect(DB_NAME)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    events = []
+    try:
+        saved = _apply_add_products(cursor, events, user_id, products)
+        stored = _store_idempotent_response(cursor, idempotency, saved)
+        conn.commit()
+    finally:
+        conn.close()
+    if stored:
+        idempotency["saved"] = True
+    _notify_all(user_id, events)
+    return saved
+
+def _apply_add_products(cursor, events: List, user_id: str, products: List[Dict]) -> List[Product]:
+    return [_apply_add_product(cursor, events, user_id, **fields) for fields in products]
 
 def remove_product(user_id: str, name: str, quantity: int) -> Tuple[Optional[Product], str]:
     conn = sqlite3.connect(DB_NAME)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
+    events = []
+    success, product, message = _apply_remove_product(cursor, events, user_id, name, quantity)
+    if success:
+        conn.commit()
+    conn.close()
+    _notify_all(user_id, events)
+    return product, message
+
+def _apply_remove_product(cursor, events: List, user_id: str, name: str,
+                          quantity: int) -> Tuple[bool, Optional[Product], str]:
+    """Take `quantity` out of stock. Returns (success, product, message); nothing is written when it fails."""
     # Clean input
     name = name.strip()
     # Case-insensitive search
@@ -188,13 +453,11 @@ def remove_product(user_id: str, name: str, quantity: int) -> Tuple[Optional[Pro
     existing = cursor.fetchone()
     
     if not existing:
-        conn.close()
-        return None, "Produit non trouvé."
+        return False, None, "Produit non trouvé."
         
     current_qty = existing["quantity"]
     if current_qty < quantity:
-        conn.close()
-        return Product(
+        return False, Product(
             id=existing["id"], 
             name=existing["name"], 
             category=existing["category"], 
@@ -203,7 +466,8 @@ def remove_product(user_id: str, name: str, quantity: int) -> Tuple[Optional[Pro
             quantity=existing["quantity"], 
             barcode=existing["barcode"],
             description=existing["description"], 
-            total_value=existing["total_value"]
+            total_value=existing["total_value"],
+            min_stock=existing["min_stock"]
         ), f"Stock insuffisant. Seulement {current_qty} en stock."
         
     new_qty = current_qty - quantity
@@ -212,11 +476,11 @@ def remove_product(user_id: str, name: str, quantity: int) -> Tuple[Optional[Pro
     cursor.execute('''
         UPDATE products SET quantity = ?, total_value = ? WHERE id = ?
     ''', (new_qty, new_total, existing["id"]))
+    _evaluate_stock_alert(cursor, user_id, existing["id"], existing["name"],
+                          existing["category"], new_qty, existing["min_stock"])
+    events.append(("stock_changed", _stock_change(existing["id"], existing["name"], new_qty, new_total)))
     
-    conn.commit()
-    conn.close()
-    
-    return Product(
+    return True, Product(
         id=existing["id"], 
         name=existing["name"], 
         category=existing["category"], 
@@ -225,100 +489,531 @@ def remove_product(user_id: str, name: str, quantity: int) -> Tuple[Optional[Pro
         quantity=new_qty, 
         barcode=existing["barcode"],
         description=existing["description"], 
-        total_value=new_total
+        total_value=new_total,
+        min_stock=existing["min_stock"]
     ), "Stock mis à jour."
 
-def get_all_products(user_id: str):
+def _fts_query(search: str) -> Optional[str]:
+    """Turn free user input into an FTS5 prefix query: 'riz par' -> '"riz"* "par"*'."""
+    terms = [t.replace('"', '""') for t in search.split()]
+    if not terms:
+        return None
+    return " ".join(f'"{t}"*' for t in terms)
+
+def encode_cursor(product, sort: str = "id") -> str:
+    """Opaque keyset cursor pointing just after `product` (a Product or a row dict) for the given sort."""
+    key = sort.lstrip("-")
+    if isinstance(product, dict):
+        value, product_id = product[key], product["id"]
+    else:
+        value, product_id = getattr(product, key), product.id
+    raw = json.dumps([value, product_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[Any, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+        return value, int(last_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Curseur de pagination invalide.") from e
+
+def set_product_threshold(user_id: str, name: str, min_stock: Optional[int]) -> Optional[Product]:
+    """Set (or clear with None) the alert threshold of a product and re-evaluate its alert."""
+    conn = sqlite3.connect(DB_NAME)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM products WHERE user_id = ? AND LOWER(name) = LOWER(?)", (user_id, name.strip()))
+    existing = cursor.fetchone()
+    if not existing:
+        conn.close()
+        return None
+
+    cursor.execute("UPDATE products SET min_stock = ? WHERE id = ?", (min_stock, existing["id"]))
+    _evaluate_stock_alert(cursor, user_id, existing["id"], existing["name"],
+                          existing["category"], existing["quantity"], min_stock)
+    conn.commit()
+    conn.close()
+    product = get_product(user_id, existing["name"])
+    _notify(user_id, "product_upserted", product.model_dump())
+    return product
+
+def set_category_threshold(user_id: str, category: str, min_stock: Optional[int]):
+    """
+    Set (or clear with None) the default alert threshold of a category.
+    Only the products of that category relying on the default are re-evaluated.
+    """
+    conn = sqlite3.connect(DB_NAME)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    if min_stock is None:
+        cursor.execute("DELETE FROM category_thresholds WHERE user_id = ? AND category = ?", (user_id, category))
+    else:
+        cursor.execute('''
+            INSERT INTO category_thresholds (user_id, category, min_stock) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, category) DO UPDATE SET min_stock = excluded.min_stock
+        ''', (user_id, category, min_stock))
+
+    cursor.execute("SELECT id, name, quantity FROM products WHERE user_id = ? AND category = ? AND min_stock IS NULL",
+                   (user_id, category))
+    for row in cursor.fetchall():
+        _evaluate_stock_alert(cursor, user_id, row["id"], row["name"], category, row["quantity"], None)
+    conn.commit()
+    conn.close()
+
+def get_open_alerts(user_id: str) -> List[Alert]:
+    """Open low-stock alerts, read from the partial index on open alerts."""
     conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row  # Access columns by name
+    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products WHERE user_id = ?", (user_id,))
+    cursor.execute('''
+        SELECT id, product_id, product_name, quantity, threshold, created_at
+        FROM alerts WHERE user_id = ? AND status = 'open' ORDER BY id DESC
+    ''', (user_id,))
     rows = cursor.fetchall()
     conn.close()
-    return [
-        Product(
-            id=r["id"], 
-            name=r["name"], 
-            category=r["category"], 
-            unit=r["unit"],
-            price=r["price"], 
-            quantity=r["quantity"], 
-            barcode=r["barcode"],
-            description=r["description"], 
-            total_value=r["total_value"]
-        ) for r in rows
-    ]
-
-def record_sale(user_id: str, items: List[Dict]) -> Tuple[bool, str, float]:
+    return [Alert(**dict(r)) for r in rows]
+
+def get_all_products(user_id: str, search: Optional[str] = None,
+                     category: Optional[str] = None, unit: Optional[str] = None,
+                     low_stock: bool = False, sort: str = "id",
+                     limit: Optional[int] = None, after: Optional[str] = None) -> List[Product]:
+    """
+    List the user's products, optionally filtered, sorted and paginated.
+
+    - search: prefix search on name, description and barcode (FTS5)
+    - category / unit: exact match filters
+    - low_stock: only products below their alert threshold (product, then category, then LOW_STOCK_THRESHOLD)
+    - sort: one of SORT_COLUMNS, prefixed with "-" for descending order
+    - limit / after: keyset pagination, `after` being a cursor from encode_cursor()
+
+    Raises ValueError on an unknown sort key or an invalid cursor.
+    """
+    rows = get_product_rows(user_id, search=search, category=category, unit=unit,
+                            low_stock=low_stock, sort=sort, limit=limit, after=after)
+    return [Product(**r) for r in rows]
+
+def get_product_rows(user_id: str, search: Optional[str] = None,
+                     category: Optional[str] = None, unit: Optional[str] = None,
+                     low_stock: bool = False, sort: str = "id",
+                     limit: Optional[int] = None, after: Optional[str] = None) -> List[Dict]:
+    """Same as get_all_products, returning plain dicts (PRODUCT_COLUMNS) without building models."""
+    key = sort.lstrip("-")
+    if key not in SORT_COLUMNS:
+        raise ValueError(f"Tri inconnu : {sort}")
+    column = SORT_COLUMNS[key]
+    descending = sort.startswith("-")
+
+    source = "products p"
+    conditions = ["p.user_id = ?"]
+    params: List[Any] = [user_id]
+
+    if search:
+        match = _fts_query(search)
+        if match:
+            # CROSS JOIN pins the FTS lookup as the outer loop; otherwise the
+            # planner may walk a sort index and probe the FTS table per row.
+            source = "products_fts f CROSS JOIN products p"
+            conditions.append("f.rowid = p.id")
+            conditions.append("products_fts MATCH ?")
+            params.append(match)
+    if category:
+        conditions.append("p.category = ?")
+        params.append(category)
+    if unit:
+        conditions.append("p.unit = ?")
+        params.append(unit)
+    if low_stock:
+        conditions.append('''p.quantity < COALESCE(p.min_stock,
+            (SELECT c.min_stock FROM category_thresholds c
+             WHERE c.user_id = p.user_id AND c.category = p.category), ?)''')
+        params.append(LOW_STOCK_THRESHOLD)
+    if after:
+        value, last_id = _decode_cursor(after)
+        op = "<" if descending else ">"
+        if key == "id":
+            conditions.append(f"p.id {op} ?")
+            params.append(last_id)
+        else:
+            conditions.append(f"(p.{column} {op} ? OR (p.{column} = ? AND p.id {op} ?))")
+            params.extend([value, value, last_id])
+
+    direction = "DESC" if descending else "ASC"
+    columns = ", ".join(f"p.{c}" for c in PRODUCT_COLUMNS)
+    sql = f"SELECT {columns} FROM {source} WHERE " + " AND ".join(conditions)
+    if key == "id":
+        sql += f" ORDER BY p.id {direction}"
+    else:
+        sql += f" ORDER BY p.{column} {direction}, p.id {direction}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    rows = [dict(zip(PRODUCT_COLUMNS, r)) for r in cursor]
+    conn.close()
+    return rows
+
+def get_inventory_stats(user_id: str) -> Dict:
+    """Aggregates shown in the inventory header, computed without loading every row."""
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(price * quantity), 0) FROM products WHERE user_id = ?", (user_id,))
+    count, total_value = cursor.fetchone()
+    version = _inventory_version(cursor, user_id)
+    conn.close()
+    return {"count": count, "total_value": total_value, "version": version}
+
+def _inventory_version(cursor, user_id: str) -> int:
+    cursor.execute("SELECT version FROM inventory_versions WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def record_sale(user_id: str, items: List[Dict],
+                idempotency: Optional[Dict] = None) -> Tuple[bool, str, float]:
+    """
+    Record a sale. Returns (False, reason, 0) when it is refused (unknown product,
+    insufficient stock); database errors are raised, so callers can tell them apart.
+    """
     conn = sqlite3.connect(DB_NAME)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
+    events = []
+    stored = False
     
+    try:
+        success, message, total = _apply_sale(cursor, events, user_id, items)
+        if success:
+            stored = _store_idempotent_response(cursor, idempotency, (success, message, total))
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    if stored:
+        idempotency["saved"] = True
+    _notify_all(user_id, events)
+    return success, message, total
+
+def _apply_sale(cursor, events: List, user_id: str, items: List[Dict],
+                date: Optional[str] = None) -> Tuple[bool, str, float]:
+    """Validate and write a sale (dated now unless `date` is given). Nothing is written when it fails."""
     total_sale_amount = 0
     sale_items_data = []
     
-    try:
-        for item in items:
-            p_name = item['name'].strip()
-            # Case-insensitive search with trim
-            cursor.execute("SELECT * FROM products WHERE user_id = ? AND LOWER(name) = LOWER(?)", (user_id, p_name))
-            product = cursor.fetchone()
-            
-            if not product:
-                return False, f"Produit inconnu : {item['name']}", 0
-            
-            if product['quantity'] < item['quantity']:
-                return False, f"Stock insuffisant pour {item['name']}", 0
-            
-            item_total = product['price'] * item['quantity']
-            total_sale_amount += item_total
-            
-            sale_items_data.append({
-                'product_id': product['id'],
-                'name': product['name'],
-                'quantity': item['quantity'],
-                'unit_price': product['price'],
-                'total_price': item_total,
-                'new_stock': product['quantity'] - item['quantity']
-            })
-            
-        date_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute("INSERT INTO sales (user_id, date, total_amount) VALUES (?, ?, ?)", 
-                       (user_id, date_str, total_sale_amount))
-        sale_id = cursor.lastrowid
+    for item in items:
+        p_name = item['name'].strip()
+        # Case-insensitive search with trim
+        cursor.execute("SELECT * FROM products WHERE user_id = ? AND LOWER(name) = LOWER(?)", (user_id, p_name))
+        product = cursor.fetchone()
         
-        for item_data in sale_items_data:
-            cursor.execute('''
-                INSERT INTO sale_items (sale_id, product_name, quantity, unit_price, total_price)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (sale_id, item_data['name'], item_data['quantity'], 
-                  item_data['unit_price'], item_data['total_price']))
-            
-            cursor.execute("UPDATE products SET quantity = ?, total_value = ? WHERE id = ?",
-                           (item_data['new_stock'], item_data['unit_price'] * item_data['new_stock'], item_data['product_id']))
-            
-        conn.commit()
-        return True, "Vente enregistrée", total_sale_amount
+        if not product:
+            return False, f"Produit inconnu : {item['name']}", 0
+        
+        if product['quantity'] < item['quantity']:
+            return False, f"Stock insuffisant pour {item['name']}", 0
+        
+        item_total = product['price'] * item['quantity']
+        total_sale_amount += item_total
         
+        sale_items_data.append({
+            'product_id': product['id'],
+            'name': product['name'],
+            'quantity': item['quantity'],
+            'unit_price': product['price'],
+            'total_price': item_total,
+            'new_stock': product['quantity'] - item['quantity'],
+            'category': product['category'],
+            'min_stock': product['min_stock']
+        })
+        
+    date_str = date or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor.execute("INSERT INTO sales (user_id, date, total_amount) VALUES (?, ?, ?)", 
+                   (user_id, date_str, total_sale_amount))
+    sale_id = cursor.lastrowid
+    
+    for item_data in sale_items_data:
+        cursor.execute('''
+            INSERT INTO sale_items (sale_id, product_name, quantity, unit_price, total_price)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (sale_id, item_data['name'], item_data['quantity'], 
+              item_data['unit_price'], item_data['total_price']))
+        
+        cursor.execute("UPDATE products SET quantity = ?, total_value = ? WHERE id = ?",
+                       (item_data['new_stock'], item_data['unit_price'] * item_data['new_stock'], item_data['product_id']))
+        _evaluate_stock_alert(cursor, user_id, item_data['product_id'], item_data['name'],
+                              item_data['category'], item_data['new_stock'], item_data['min_stock'])
+        events.append(("stock_changed", _stock_change(
+            item_data['product_id'], item_data['name'], item_data['new_stock'],
+            item_data['unit_price'] * item_data['new_stock'])))
+
+    events.append(("sale_recorded", {
+        "id": sale_id, "date": date_str, "total_amount": total_sale_amount,
+        "items": [{"product_name": i['name'], "quantity": i['quantity'],
+                   "unit_price": i['unit_price'], "total_price": i['total_price']}
+                  for i in sale_items_data]
+    }))
+    return True, "Vente enregistrée", total_sale_amount
+
+# Mutations accepted by apply_batch. They write nothing when they report a failure.
+_BATCH_OPERATIONS = {
+    "sale": _apply_sale,
+    "add": _apply_add_product,
+    "add_many": _apply_add_products,
+    "remove": _apply_remove_product,
+}
+
+def _batch_result(kind: str, result: Any) -> Tuple[bool, Any]:
+    """Whether a batch operation succeeded, and its result shaped like the public function's."""
+    if kind == "sale":
+        return result[0], result
+    if kind == "remove":
+        success, product, message = result
+        return success, (product, message)
+    return True, result
+
+def apply_batch(operations: List[Tuple[str, str, Dict]]) -> List[Any]:
+    """
+    Apply several mutations in a single transaction (group commit).
+
+    Each operation is (kind, user_id, kwargs) with kind "sale", "add", "add_many" or
+    "remove", kwargs being the arguments of record_sale / add_product / add_products /
+    remove_product (including their optional `idempotency` record).
+    An operation reporting a failure (unknown product, insufficient stock) or raising
+    is rolled back to its own savepoint, so it does not affect the rest of the batch.
+    Returns one result per operation, shaped like the matching public function's
+    return value, or the exception raised.
+    """
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    results: List[Any] = []
+    pending_events = []
+    stored_records = []
+
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        for kind, user_id, kwargs in operations:
+            events = []
+            cursor.execute("SAVEPOINT operation")
+            try:
+                kwargs = dict(kwargs)
+                idempotency = kwargs.pop("idempotency", None)
+                success, result = _batch_result(kind, _BATCH_OPERATIONS[kind](cursor, events, user_id, **kwargs))
+                if success:
+                    if _store_idempotent_response(cursor, idempotency, result):
+                        stored_records.append(idempotency)
+                else:
+                    cursor.execute("ROLLBACK TO operation")
+                    events = []
+            except Exception as e:
+                cursor.execute("ROLLBACK TO operation")
+                result, events = e, []
+            cursor.execute("RELEASE operation")
+            results.append(result)
+            pending_events.append((user_id, events))
+        cursor.execute("COMMIT")
     except Exception as e:
-        conn.rollback()
-        return False, str(e), 0
+        if conn.in_transaction:
+            conn.rollback()
+        return [e] * len(operations)
     finally:
         conn.close()
 
+    for record in stored_records:
+        record["saved"] = True
+
+    for user_id, events in pending_events:
+        _notify_all(user_id, events)
+    return results
+
+def _apply_sync_operation(cursor, events: List, user_id: str, operation: Dict) -> Tuple[bool, str, Any]:
+    products = operation["products"]
+    if operation["type"] == "sale":
+        items = [{"name": p["name"], "quantity": p["quantity"]} for p in products]
+        success, message, total = _apply_sale(cursor, events, user_id, items, date=operation.get("date"))
+        return success, message, {"total_amount": total} if success else None
+    if operation["type"] == "add":
+        saved = [_apply_add_product(cursor, events, user_id, **p) for p in products]
+        return True, "Stock mis à jour.", [p.model_dump() for p in saved]
+
+    removed = []
+    for p in products:
+        success, product, message = _apply_remove_product(cursor, events, user_id, p["name"], p["quantity"])
+        if not success:
+            return False, f"{p['name']} : {message}", None
+        removed.append(product.model_dump())
+    return True, "Stock mis à jour.", removed
+
+def _save_sync_operation(cursor, user_id: str, operation: Dict, status: str, message: str, result: Any):
+    cursor.execute('''
+        INSERT INTO sync_operations (user_id, op_id, type, client_timestamp, status, message, result, synced_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, operation["op_id"], operation["type"], operation.get("client_timestamp"), status, message,
+          json.dumps(result) if result is not None else None,
+          datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+def _idempotent_request_outcome(op_type: str, status_code: int, response: Any) -> Tuple[str, str, Any]:
+    """(status, message, result) of a sync operation already handled by /sales/confirm or /products/add-multiple."""
+    if status_code >= 400:
+        return "failed", response.get("detail") or "Opération refusée.", None
+    if op_type == "sale":
+        return "applied", response["message"], {"total_amount": response["total_amount"]}
+    return "applied", "Stock mis à jour.", response
+
+def apply_sync(user_id: str, operations: List[Dict]) -> Tuple[List[Dict], int]:
+    """
+    Apply operations queued by an offline client, in order, in one transaction.
+
+    Each operation is a dict with op_id, type ("add", "sale" or "remove"), products
+    (ProductInput fields) and optionally client_timestamp and date (sale date).
+    An op_id synced in the last SYNC_RETENTION_DAYS days, or already used as the
+    Idempotency-Key of a request that reached the server before the connection
+    dropped (kept 24 h), is not applied again: its stored outcome is returned, with
+    duplicate set. Older synced operations of the user are deleted on each sync. A failing operation is rolled back
+    alone (status "failed").
+    Returns the per-operation results and the inventory version after the sync.
+    """
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    results = []
+    events = []
+
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cutoff = datetime.now() - timedelta(days=SYNC_RETENTION_DAYS)
+        cursor.execute("DELETE FROM sync_operations WHERE user_id = ? AND synced_at < ?",
+                       (user_id, cutoff.strftime("%Y-%m-%d %H:%M:%S")))
+        for operation in operations:
+            op_id = operation["op_id"]
+            cursor.execute("SELECT status, message, result FROM sync_operations WHERE user_id = ? AND op_id = ?",
+                           (user_id, op_id))
+            done = cursor.fetchone()
+            if done:
+                results.append({"op_id": op_id, "status": done["status"], "duplicate": True, "message": done["message"],
+                                "result": json.loads(done["result"]) if done["result"] else None})
+                continue
+
+            cursor.execute("SELECT status_code, response FROM idempotency_keys WHERE user_id = ? AND key = ?",
+                           (user_id, op_id))
+            request = cursor.fetchone()
+            if request:
+                status, message, result = _idempotent_request_outcome(operation["type"], request["status_code"],
+                                                                      json.loads(request["response"]))
+                _save_sync_operation(cursor, user_id, operation, status, message, result)
+                results.append({"op_id": op_id, "status": status, "duplicate": True, "message": message, "result": result})
+                continue
+
+            op_events = []
+            cursor.execute("SAVEPOINT operation")
+            try:
+                success, message, result = _apply_sync_operation(cursor, op_events, user_id, operation)
+            except Exception as e:
+                success, message, result = False, str(e), None
+            if not success:
+                cursor.execute("ROLLBACK TO operation")
+                op_events = []
+            cursor.execute("RELEASE operation")
+
+            status = "applied" if success else "failed"
+            _save_sync_operation(cursor, user_id, operation, status, message, result)
+            events.extend(op_events)
+            results.append({"op_id": op_id, "status": status, "duplicate": False, "message": message, "result": result})
+
+        version = _inventory_version(cursor, user_id)
+        cursor.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    _notify_all(user_id, events)
+    return results, version
+
 def get_sales_history(user_id: str):
     conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
+    conn.row_factory = _dict_factory
     cursor = conn.cursor()
     
     # Get sales
     cursor.execute("SELECT * FROM sales WHERE user_id = ? ORDER BY date DESC LIMIT 50", (user_id,))
-    sales = [dict(s) for s in cursor.fetchall()]
+    sales = cursor.fetchall()
     
-    # Get items for each sale
+    # Get the items of all these sales in one query
+    by_id = {}
     for sale in sales:
-        cursor.execute("SELECT * FROM sale_items WHERE sale_id = ?", (sale['id'],))
-        sale['items'] = [dict(item) for item in cursor.fetchall()]
+        sale['items'] = []
+        by_id[sale['id']] = sale
+    if by_id:
+        placeholders = ", ".join("?" * len(by_id))
+        cursor.execute(f"SELECT * FROM sale_items WHERE sale_id IN ({placeholders}) ORDER BY id", list(by_id))
+        for item in cursor.fetchall():
+            by_id[item['sale_id']]['items'].append(item)
         
     conn.close()
     return sales
+
+def get_idempotency_record(user_id: str, key: str, max_age: float) -> Optional[Dict]:
+    """Stored response for an idempotency key, unless older than max_age seconds."""
+    conn = sqlite3.connect(DB_NAME)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT fingerprint, status_code, response, created_at FROM idempotency_keys
+        WHERE user_id = ? AND key = ? AND created_at >= ?
+    ''', (user_id, key, time.time() - max_age))
+    row = cursor.fetchone()
+    conn.close()
+    if not row:
+        return None
+    record = dict(row)
+    record["response"] = json.loads(record["response"])
+    return record
+
+def save_idempotency_record(user_id: str, key: str, fingerprint: str, status_code: int,
+                            response: Any, max_age: float, max_keys: int):
+    """Store a response, then drop the user's expired keys and keep only the newest max_keys."""
+    conn = sqlite3.connect(DB_NAME)
+    cursor = conn.cursor()
+    _save_idempotency_record(cursor, user_id, key, fingerprint, status_code, response, max_age, max_keys)
+    conn.commit()
+    conn.close()
+
+def _store_idempotent_response(cursor, idempotency: Optional[Dict], result: Any) -> bool:
+    """
+    Write the response of an idempotent mutation in the mutation's own transaction,
+    so a crash can never leave the mutation committed without its key.
+
+    `idempotency` is the record built by IdempotencyStore.record(), its "response"
+    callable turning `result` into the (status_code, body) the endpoint returns, or
+    None when the mutation failed and wrote nothing. Returns whether a row was
+    written: the caller sets idempotency["saved"] once its transaction is committed.
+    """
+    response = idempotency["response"](result) if idempotency else None
+    if response is None:
+        return False
+    status_code, response = response
+    _save_idempotency_record(cursor, idempotency["user_id"], idempotency["key"], idempotency["fingerprint"],
+                             status_code, response, idempotency["max_age"], idempotency["max_keys"])
+    return True
+
+def _save_idempotency_record(cursor, user_id: str, key: str, fingerprint: str, status_code: int,
+                             response: Any, max_age: float, max_keys: int):
+    now = time.time()
+    cursor.execute('''
+        INSERT OR REPLACE INTO idempotency_keys (user_id, key, fingerprint, status_code, response, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, key, fingerprint, status_code, json.dumps(response), now))
+    cursor.execute("DELETE FROM idempotency_keys WHERE user_id = ? AND created_at < ?", (user_id, now - max_age))
+    cursor.execute('''
+        DELETE FROM idempotency_keys WHERE user_id = ? AND key NOT IN (
+            SELECT key FROM idempotency_keys WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
+        )
+    ''', (user_id, user_id, max_keys))
@@ -1,6 +1,7 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+import json
 import shutil
 import os
 import uuid
@@ -8,16 +9,28 @@ from typing import List, Optional
 
 # Load environment variables
 load_dotenv()
-from models import VoiceCommandResponse, Product, ProductInput, CATEGORIES, UNITS
+from models import (
+    VoiceCommandResponse, Product, ProductInput, Alert,
+    ThresholdInput, CategoryThresholdInput, SyncRequest, SyncResponse,
+    CATEGORIES, UNITS
+)
 from database import (
-    init_db, get_all_products, add_product, remove_product, 
-    get_product, record_sale, get_sales_history
+    init_db, get_product_rows, add_product, add_products, remove_product, 
+    get_product, record_sale, get_sales_history,
+    encode_cursor, get_inventory_stats,
+    get_open_alerts, set_product_threshold, set_category_threshold,
+    add_change_listener, apply_sync
 )
 from core.transcriber import transcribe_audio
 from core.parser import parse_intent
+from core.events import hub
+from core.group_commit import writer, GROUP_COMMIT_ENABLED
+from core.idempotency import idempotency, fingerprint, IdempotencyConflict
+from core.serialization import encode_response
 
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 
 app = FastAPI(
     title="StockAlert API",
@@ -31,10 +44,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
 )
 
 # Initialize DB on startup
 init_db()
+# Push committed changes to the /events subscribers
+add_change_listener(hub.publish)
 
 # Dependency to get user_id
 async def get_user_id(x_user_id: str = Header(..., description="Unique ID of the user")):
@@ -42,120 +58,297 @@ async def get_user_id(x_user_id: str = Header(..., description="Unique ID of the
         raise HTTPException(status_code=400, detail="X-User-ID header is required")
     return x_user_id
 
+# Dependency to get the optional Idempotency-Key
+async def get_idempotency_key(
+    idempotency_key: Optional[str] = Header(None, description="Unique key of this operation; retries with the same key replay the first response")
+):
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1 to 255 characters")
+    return idempotency_key
+
+def json_fingerprint(route: str, payload) -> str:
+    return fingerprint(route.encode(), json.dumps(jsonable_encoder(payload), sort_keys=True).encode())
+
+async def run_idempotent(user_id: str, key: Optional[str], request_fingerprint: str, handler,
+                         record: Optional[dict] = None):
+    """
+    Run an endpoint handler at most once per Idempotency-Key and replay its response
+    to retries. Client errors are stored too; 5xx errors are not, so they can be retried.
+    `record` comes from idempotency.record() when the handler's mutation stores its
+    response in its own transaction.
+    """
+    if key is None:
+        return await handler()
+
+    async def call():
+        try:
+            return 200, jsonable_encoder(await handler())
+        except HTTPException as e:
+            if e.status_code >= 500:
+                raise
+            return e.status_code, {"detail": e.detail}
+
+    try:
+        (status_code, body), replayed = await idempotency.run(user_id, key, request_fingerprint, call, record)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return JSONResponse(status_code=status_code, content=body, headers=headers)
+
+@app.get("/events")
+async def events(
+    request: Request,
+    user_id: Optional[str] = Query(None, description="User ID, for clients like EventSource that cannot set headers"),
+    x_user_id: Optional[str] = Header(None),
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Server-Sent Events stream of the user's inventory changes:
+    `product_upserted`, `stock_changed`, `sale_recorded`, and `reset` when the
+    client must reload because events since its `Last-Event-ID` are no longer available.
+    """
+    user_id = x_user_id or user_id
+    if not user_id:
+        raise HTTPException(status_code=400, detail="X-User-ID header is required")
+
+    async def event_stream():
+        async for chunk in hub.stream(user_id, last_event_id):
+            if await request.is_disconnected():
+                break
+            yield chunk
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/")
 async def read_root():
     return FileResponse('static/index.html')
 
 @app.get("/products", response_model=List[Product])
-async def get_products(user_id: str = Depends(get_user_id)):
-    """Get all products for the current user."""
-    return get_all_products(user_id)
+async def get_products(
+    request: Request,
+    q: Optional[str] = Query(None, description="Prefix search on name, description and barcode"),
+    category: Optional[str] = Query(None, description=f"Filter by category from {CATEGORIES}"),
+    unit: Optional[str] = Query(None, description=f"Filter by unit from {UNITS}"),
+    low_stock: bool = Query(False, description="Only products running low"),
+    sort: str = Query("id", description="Sort key (id, name, category, price, quantity, total_value), '-' prefix for descending"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size"),
+    cursor: Optional[str] = Query(None, description="Value of the X-Next-Cursor header from the previous page"),
+    user_id: str = Depends(get_user_id)
+):
+    """
+    Get the products for the current user.
+    Without parameters, returns the whole inventory. When `limit` is set and more
+    results are available, the `X-Next-Cursor` response header holds the next page cursor.
+    Rows come straight from the database, so they are encoded without re-validation
+    (JSON, or MessagePack with `Accept: application/msgpack`).
+    """
+    try:
+        products = get_product_rows(
+            user_id, search=q, category=category, unit=unit,
+            low_stock=low_stock, sort=sort, limit=limit, after=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {}
+    if limit is not None and len(products) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(products[-1], sort)
+    return encode_response(request, products, headers=headers)
 
-@app.post("/products/add", response_model=Product)
-async def add_product_endpoint(product: ProductInput, user_id: str = Depends(get_user_id)):
-    """Add or update a single product."""
-    return add_product(
-        user_id=user_id,
+@app.get("/products/stats")
+async def get_products_stats(user_id: str = Depends(get_user_id)):
+    """Product count and total stock value for the current user."""
+    return get_inventory_stats(user_id)
+
+def product_fields(product: ProductInput) -> dict:
+    """Arguments of database.add_product for a product input."""
+    return dict(
         name=product.name,
         price=product.price,
         quantity=product.quantity,
         category=product.category,
         unit=product.unit,
         barcode=product.barcode,
-        description=product.description
+        description=product.description,
+        min_stock=product.min_stock
     )
 
+def products_response(products: List[Product]):
+    return 200, [p.model_dump() for p in products]
+
+async def save_product(user_id: str, product: ProductInput) -> Product:
+    """Add or update a product, through the group-commit writer when enabled."""
+    fields = product_fields(product)
+    if GROUP_COMMIT_ENABLED:
+        return await writer.add_product(user_id, **fields)
+    return add_product(user_id=user_id, **fields)
+
+@app.post("/products/add", response_model=Product)
+async def add_product_endpoint(product: ProductInput, user_id: str = Depends(get_user_id)):
+    """Add or update a single product."""
+    return await save_product(user_id, product)
+
 @app.post("/products/add-multiple", response_model=List[Product])
-async def add_multiple_products(products: List[ProductInput], user_id: str = Depends(get_user_id)):
-    """Add or update multiple products at once."""
-    results = []
-    for p in products:
-        res = add_product(
-            user_id=user_id,
-            name=p.name,
-            price=p.price,
-            quantity=p.quantity,
-            category=p.category,
-            unit=p.unit,
-            barcode=p.barcode,
-            description=p.description
-        )
-        results.append(res)
-    return results
+async def add_multiple_products(
+    products: List[ProductInput],
+    user_id: str = Depends(get_user_id),
+    idempotency_key: Optional[str] = Depends(get_idempotency_key)
+):
+    """Add or update multiple products at once, in a single transaction."""
+    request_fingerprint = json_fingerprint("/products/add-multiple", products)
+    record = idempotency.record(user_id, idempotency_key, request_fingerprint, products_response) if idempotency_key else None
+    fields = [product_fields(p) for p in products]
+
+    async def handle():
+        if GROUP_COMMIT_ENABLED:
+            return await writer.add_products(user_id, fields, idempotency=record)
+        return add_products(user_id, fields, idempotency=record)
+
+    return await run_idempotent(user_id, idempotency_key, request_fingerprint, handle, record)
+
+@app.put("/products/threshold", response_model=Product)
+async def set_product_threshold_endpoint(threshold: ThresholdInput, user_id: str = Depends(get_user_id)):
+    """Set the low-stock alert threshold of a product."""
+    product = set_product_threshold(user_id, threshold.name, threshold.min_stock)
+    if not product:
+        raise HTTPException(status_code=404, detail="Produit non trouvé.")
+    return product
+
+@app.put("/categories/threshold")
+async def set_category_threshold_endpoint(threshold: CategoryThresholdInput, user_id: str = Depends(get_user_id)):
+    """Set the default low-stock alert threshold of a category."""
+    if threshold.category not in CATEGORIES:
+        raise HTTPException(status_code=400, detail=f"Catégorie inconnue : {threshold.category}")
+    set_category_threshold(user_id, threshold.category, threshold.min_stock)
+    return {"status": "success", "category": threshold.category, "min_stock": threshold.min_stock}
+
+@app.get("/alerts", response_model=List[Alert])
+async def get_alerts(user_id: str = Depends(get_user_id)):
+    """Open low-stock alerts for the current user, most recent first."""
+    return get_open_alerts(user_id)
 
 @app.post("/command/audio", response_model=VoiceCommandResponse)
 async def process_audio_command(
     file: UploadFile = File(...), 
-    user_id: str = Depends(get_user_id)
+    user_id: str = Depends(get_user_id),
+    idempotency_key: Optional[str] = Depends(get_idempotency_key)
 ):
     """
     Process an audio file (WebM/WAV) containing a voice command.
     Returns the parsed intent and products found.
     """
-    # Save temp file
-    temp_filename = f"temp_{uuid.uuid4()}.webm"
-    with open(temp_filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # The multipart boundary changes between retries: fingerprint the audio itself
+    request_fingerprint = fingerprint(b"/command/audio", await file.read())
+    await file.seek(0)
+
+    async def handle():
+        # Save temp file
+        temp_filename = f"temp_{uuid.uuid4()}.webm"
+        with open(temp_filename, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
     
-    try:
-        # 1. Transcribe
-        text = transcribe_audio(temp_filename)
+        try:
+            # 1. Transcribe
+            text = transcribe_audio(temp_filename)
         
-        # 2. Parse Intent
-        intent = parse_intent(text)
+            # 2. Parse Intent
+            intent = parse_intent(text)
         
-        # 3. Prepare response
-        products_found = []
-        if (intent["action"] == "add" or intent["action"] == "sell") and intent.get("products"):
-            for p in intent["products"]:
-                products_found.append(ProductInput(**p))
+            # 3. Prepare response
+            products_found = []
+            if (intent["action"] == "add" or intent["action"] == "sell") and intent.get("products"):
+                for p in intent["products"]:
+                    products_found.append(ProductInput(**p))
         
-        # Customize message based on intent/transcription
-        text_lower = text.lower()
-        hallucinations = ["sous-titrage", "merci d'avoir regardé", "amara.org", "sous-titres", "st' 501"]
+            # Customize message based on intent/transcription
+            text_lower = text.lower()
+            hallucinations = ["sous-titrage", "merci d'avoir regardé", "amara.org", "sous-titres", "st' 501"]
         
-        is_hallucination = any(h in text_lower for h in hallucinations)
+            is_hallucination = any(h in text_lower for h in hallucinations)
         
-        if not text or len(text.strip()) < 2 or is_hallucination:
-            msg = "🎤 Je n'ai rien entendu. Parlez un peu plus fort."
-        elif intent["action"] == "unknown":
-            msg = "🤔 Commande non comprise. Réessayez."
-        else:
-            msg = "✅ Confirmez les produits ci-dessous"
+            if not text or len(text.strip()) < 2 or is_hallucination:
+                msg = "🎤 Je n'ai rien entendu. Parlez un peu plus fort."
+            elif intent["action"] == "unknown":
+                msg = "🤔 Commande non comprise. Réessayez."
+            else:
+                msg = "✅ Confirmez les produits ci-dessous"
 
-        return VoiceCommandResponse(
-            original_text=text,
-            action=intent["action"],
-            products=products_found,
-            message=msg
-        )
+            return VoiceCommandResponse(
+                original_text=text,
+                action=intent["action"],
+                products=products_found,
+                message=msg
+            )
         
-    except Exception as e:
-        print(f"Error processing audio: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # Cleanup
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+        except Exception as e:
+            print(f"Error processing audio: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            # Cleanup
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+
+    return await run_idempotent(user_id, idempotency_key, request_fingerprint, handle)
 
 @app.get("/sales")
-async def get_sales(user_id: str = Depends(get_user_id)):
-    return get_sales_history(user_id)
+async def get_sales(request: Request, user_id: str = Depends(get_user_id)):
+    return encode_response(request, get_sales_history(user_id))
+
+def sale_response(result):
+    """Response of a recorded sale, None when it was refused."""
+    success, message, total = result
+    if not success:
+        return None
+    return 200, {"status": "success", "message": message, "total_amount": total}
 
 @app.post("/sales/confirm")
 async def confirm_sale(
     products: List[ProductInput], 
-    user_id: str = Depends(get_user_id)
+    user_id: str = Depends(get_user_id),
+    idempotency_key: Optional[str] = Depends(get_idempotency_key)
 ):
     # Convert ProductInput to dict for database function
     items = [{'name': p.name, 'quantity': p.quantity} for p in products]
-    
-    success, message, total = record_sale(user_id, items)
-    
-    if not success:
-        raise HTTPException(status_code=400, detail=message)
+    request_fingerprint = json_fingerprint("/sales/confirm", items)
+    record = idempotency.record(user_id, idempotency_key, request_fingerprint, sale_response) if idempotency_key else None
+
+    async def handle():
+        if GROUP_COMMIT_ENABLED:
+            result = await writer.record_sale(user_id, items, idempotency=record)
+        else:
+            result = record_sale(user_id, items, idempotency=record)
         
-    return {"status": "success", "message": message, "total_amount": total}
+        response = sale_response(result)
+        if response is None:
+            raise HTTPException(status_code=400, detail=result[1])
+            
+        return response[1]
+
+    return await run_idempotent(user_id, idempotency_key, request_fingerprint, handle, record)
+
+@app.post("/sync", response_model=SyncResponse)
+async def sync_operations(sync: SyncRequest, user_id: str = Depends(get_user_id)):
+    """
+    Apply operations queued while offline, in order and in a single transaction.
+    Operations already synced (same op_id) are not re-applied: their original outcome is
+    returned with duplicate set;
+    sales keep the date they were made on the device.
+    """
+    operations = [
+        {
+            "op_id": op.op_id,
+            "type": op.type,
+            "client_timestamp": op.client_timestamp.isoformat(),
+            "date": op.client_timestamp.astimezone().strftime("%Y-%m-%d %H:%M:%S"),
+            "products": [p.model_dump() for p in op.products],
+        }
+        for op in sync.operations
+    ]
+    results, version = apply_sync(user_id, operations)
+    return {"results": results, "inventory_version": version}
 
 @app.get("/api/categories")
 def get_categories():
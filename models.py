@@ -1,9 +1,14 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Literal, List
+from typing import Optional, Literal, List, Any
+from datetime import datetime
 
 # Categories for products
 CATEGORIES = ["alimentation", "vêtements", "cosmétiques", "autres"]
 UNITS = ["Unité", "Kg", "Litre", "Carton", "Sac", "Paquet"]
+# Stock below this quantity is considered low, unless a product or category threshold is set
+LOW_STOCK_THRESHOLD = 5
+# An open alert is resolved once stock is back this far above the threshold (min. 1 unit)
+ALERT_HYSTERESIS_PERCENT = 20
 
 class Product(BaseModel):
     id: Optional[int] = Field(None, description="Unique identifier of the product")
@@ -15,6 +20,7 @@ class Product(BaseModel):
     barcode: Optional[str] = Field(None, description="Scanned barcode", example="123456789")
     description: Optional[str] = Field(None, description="Additional details", example="Sac de 50kg")
     total_value: float = Field(0, description="Calculated total value (price * quantity)")
+    min_stock: Optional[int] = Field(None, description="Low-stock alert threshold (defaults to the category threshold)", example=10)
 
 class ProductInput(BaseModel):
     """Input for adding a product (from voice or form)"""
@@ -25,6 +31,46 @@ class ProductInput(BaseModel):
     quantity: int = Field(0, description="Quantity to add/update", example=10)
     barcode: Optional[str] = Field(None, description="Scanned barcode")
     description: Optional[str] = Field(None, description="Additional details")
+    min_stock: Optional[int] = Field(None, ge=0, description="Low-stock alert threshold")
+
+class ThresholdInput(BaseModel):
+    """Alert threshold of a product. null falls back to the category default."""
+    name: str = Field(..., description="Name of the product", example="Riz Parfum")
+    min_stock: Optional[int] = Field(None, ge=0, description="Minimum stock before alerting", example=10)
+
+class CategoryThresholdInput(BaseModel):
+    """Default alert threshold for the products of a category. null restores the global default."""
+    category: str = Field(..., description=f"Category from {CATEGORIES}", example="alimentation")
+    min_stock: Optional[int] = Field(None, ge=0, description="Minimum stock before alerting", example=5)
+
+class Alert(BaseModel):
+    id: int = Field(..., description="Unique identifier of the alert")
+    product_id: int = Field(..., description="Product running low")
+    product_name: str = Field(..., description="Name of the product")
+    quantity: int = Field(..., description="Current stock quantity")
+    threshold: int = Field(..., description="Threshold that was crossed")
+    created_at: str = Field(..., description="When the stock crossed the threshold")
+
+class SyncOperation(BaseModel):
+    """Operation confirmed while offline, replayed by POST /sync"""
+    op_id: str = Field(..., min_length=1, max_length=64, description="Client-generated unique ID, used to detect duplicates")
+    type: Literal["add", "sale", "remove"] = Field(..., description="Kind of operation")
+    client_timestamp: datetime = Field(..., description="When the operation was confirmed on the device")
+    products: List[ProductInput] = Field(..., min_length=1, description="Products added, sold or removed")
+
+class SyncRequest(BaseModel):
+    operations: List[SyncOperation] = Field(..., max_length=500, description="Operations in the order they were made")
+
+class SyncResult(BaseModel):
+    op_id: str = Field(..., description="ID of the operation")
+    status: Literal["applied", "failed"] = Field(..., description="Outcome, the original one for a duplicate")
+    duplicate: bool = Field(False, description="Already synced before: not applied again")
+    message: str = Field(..., description="Human readable outcome")
+    result: Optional[Any] = Field(None, description="Sale total, or products after the operation")
+
+class SyncResponse(BaseModel):
+    results: List[SyncResult] = Field(..., description="One result per operation, in order")
+    inventory_version: int = Field(..., description="Inventory version after the sync")
 
 class VoiceCommandResponse(BaseModel):
     original_text: str = Field(..., description="Transcribed text from audio")
@@ -38,6 +38,24 @@ async function authFetch(url, options = {}) {
     }
 }
 
+// Mutations carry an Idempotency-Key so a retry after a timeout is not applied twice
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + '-' + Math.random().toString(36).substr(2, 12);
+}
+
+async function idempotentFetch(url, options = {}, retries = 1) {
+    options.headers = options.headers || {};
+    options.headers['Idempotency-Key'] = options.headers['Idempotency-Key'] || newIdempotencyKey();
+    try {
+        return await authFetch(url, options);
+    } catch (err) {
+        if (retries <= 0) throw err;
+        console.warn("[IdempotentFetch] Retrying with the same key...");
+        return idempotentFetch(url, options, retries - 1);
+    }
+}
+
 // Init
 document.addEventListener('DOMContentLoaded', () => {
     console.log("App initialized");
@@ -47,8 +65,73 @@ document.addEventListener('DOMContentLoaded', () => {
     setupFilters();
     setupConfirmModal();
     setupNavigation();
+    setupLiveUpdates();
+    syncOfflineQueue();
 });
 
+window.addEventListener('online', syncOfflineQueue);
+
+// ========================
+// LIVE UPDATES (Server-Sent Events)
+// ========================
+// Changes made from any phone of the shop are pushed here; we patch the
+// loaded data instead of re-downloading it.
+let liveUpdates = false;
+let statsTimer = null;
+
+function setupLiveUpdates() {
+    if (!window.EventSource) return;
+
+    const source = new EventSource(`${API_URL}/events?user_id=${encodeURIComponent(userId)}`);
+    source.onopen = () => { liveUpdates = true; };
+    source.onerror = () => { liveUpdates = false; }; // EventSource reconnects with Last-Event-ID
+
+    source.addEventListener('product_upserted', (e) => applyProductUpsert(JSON.parse(e.data)));
+    source.addEventListener('stock_changed', (e) => applyStockChange(JSON.parse(e.data)));
+    source.addEventListener('sale_recorded', (e) => applySaleRecorded(JSON.parse(e.data)));
+    source.addEventListener('reset', () => {
+        fetchProducts();
+        fetchSalesHistory();
+    });
+}
+
+function applyProductUpsert(product) {
+    const products = window.currentProducts || [];
+    const index = products.findIndex(p => p.id === product.id);
+    if (index >= 0) {
+        products[index] = product;
+    } else if (!productQuery.q && !productQuery.lowStock && !nextCursor) {
+        products.push(product);
+    }
+    window.currentProducts = products;
+    renderList(products);
+    scheduleStatsRefresh();
+}
+
+function applyStockChange(change) {
+    const product = (window.currentProducts || []).find(p => p.id === change.id);
+    if (product) {
+        product.quantity = change.quantity;
+        product.total_value = change.total_value;
+        renderList(window.currentProducts);
+    }
+    scheduleStatsRefresh();
+}
+
+function applySaleRecorded(sale) {
+    window.currentSales = [sale, ...(window.currentSales || [])].slice(0, 50);
+    renderSales(window.currentSales);
+    updateSalesStats(window.currentSales);
+}
+
+function scheduleStatsRefresh() {
+    clearTimeout(statsTimer);
+    statsTimer = setTimeout(() => {
+        updateStats();
+        fetchSalesStock();
+    }, 500);
+}
+
 // Navigation
 function setupNavigation() {
     const navItems = document.querySelectorAll('.nav-item');
@@ -97,32 +180,39 @@ function setupFilters() {
 }
 
 function filterProducts(filter) {
-    if (!window.currentProducts) return;
-    let filtered = window.currentProducts;
-    if (filter === 'low') {
-        filtered = window.currentProducts.filter(p => p.quantity < 5);
-    }
-    renderList(filtered);
+    productQuery.lowStock = (filter === 'low');
+    fetchProducts();
 }
 
-// Search Filter
+// Search Filter (server-side, debounced)
+let searchTimer = null;
 searchInput.addEventListener('input', (e) => {
-    const term = e.target.value.toLowerCase();
-    const cards = document.querySelectorAll('.product-card');
-    cards.forEach(card => {
-        const name = card.dataset.name.toLowerCase();
-        card.style.display = name.includes(term) ? 'flex' : 'none';
-    });
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => {
+        productQuery.q = e.target.value.trim();
+        fetchProducts();
+    }, 250);
 });
 
 // Fetch Products
-async function fetchProducts() {
+// The server handles search, filters and pagination; we only keep loaded pages.
+const PAGE_SIZE = 100;
+let productQuery = { q: '', lowStock: false };
+let nextCursor = null;
+
+async function fetchProducts(append = false) {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (productQuery.q) params.set('q', productQuery.q);
+    if (productQuery.lowStock) params.set('low_stock', 'true');
+    if (append && nextCursor) params.set('cursor', nextCursor);
+
     try {
-        const res = await authFetch(`${API_URL}/products`);
+        const res = await authFetch(`${API_URL}/products?${params}`);
         const products = await res.json();
-        window.currentProducts = products;
-        renderList(products);
-        updateStats(products);
+        nextCursor = res.headers.get('X-Next-Cursor');
+        window.currentProducts = append ? (window.currentProducts || []).concat(products) : products;
+        renderList(window.currentProducts);
+        if (!append) updateStats();
     } catch (err) {
         console.error("Error fetching products:", err);
         showToast("Erreur de chargement");
@@ -168,7 +258,31 @@ function renderList(items) {
         productsList.appendChild(card);
     });
 
-    // Update stock list on sales page too
+    if (nextCursor) {
+        const moreBtn = document.createElement('button');
+        moreBtn.className = 'btn btn-cancel';
+        moreBtn.textContent = 'Charger plus';
+        moreBtn.addEventListener('click', () => fetchProducts(true));
+        productsList.appendChild(moreBtn);
+    }
+}
+
+// Stock list of the sales page: its own query, independent of the inventory search and pages
+const SALES_STOCK_SIZE = 100;
+
+async function fetchSalesStock() {
+    const params = new URLSearchParams({ sort: '-quantity', limit: SALES_STOCK_SIZE });
+    try {
+        const res = await authFetch(`${API_URL}/products?${params}`);
+        if (!res.ok) return;
+        window.salesStock = await res.json();
+        renderSalesStock(window.salesStock);
+    } catch (err) {
+        console.error("Error fetching sales stock:", err);
+    }
+}
+
+function renderSalesStock(items) {
     const salesStockList = document.getElementById('sales-stock-list');
     if (salesStockList) {
         salesStockList.innerHTML = items
@@ -186,10 +300,12 @@ function renderList(items) {
 }
 
 async function fetchSalesHistory() {
+    fetchSalesStock();
     try {
         const response = await authFetch(`${API_URL}/sales`);
         if (response.ok) {
             const sales = await response.json();
+            window.currentSales = sales;
             renderSales(sales);
             updateSalesStats(sales);
         }
@@ -243,10 +359,15 @@ function updateSalesStats(sales) {
     if (todayEl) todayEl.textContent = todaySales;
 }
 
-function updateStats(products) {
-    document.getElementById('total-count').textContent = products.length;
-    const totalVal = products.reduce((sum, p) => sum + (p.price * p.quantity), 0);
-    document.getElementById('total-value').textContent = `${totalVal.toLocaleString()} FCFA`;
+async function updateStats() {
+    try {
+        const res = await authFetch(`${API_URL}/products/stats`);
+        const stats = await res.json();
+        document.getElementById('total-count').textContent = stats.count;
+        document.getElementById('total-value').textContent = `${stats.total_value.toLocaleString()} FCFA`;
+    } catch (err) {
+        console.error("Error fetching stats:", err);
+    }
 }
 
 // ========================
@@ -459,7 +580,7 @@ async function sendAudioCommand(blob) {
     formData.append("file", blob, "command.webm");
 
     try {
-        const response = await authFetch(`${API_URL}/command/audio`, {
+        const response = await idempotentFetch(`${API_URL}/command/audio`, {
             method: 'POST',
             body: formData
         });
@@ -473,6 +594,7 @@ async function sendAudioCommand(blob) {
         if (response.ok && data.action !== 'unknown') {
             // Show confirmation modal (it will hide loading)
             pendingCommand = data;
+            await fillMissingPrices(data);
             showConfirmModal(data);
         } else {
             hideLoadingModal();
@@ -510,6 +632,33 @@ function hideLoadingModal() {
     // Note: micBtn visibility will be handled by showConfirmModal or hideConfirmModal
 }
 
+// Sales and removals: take the missing prices from the stored products
+async function fillMissingPrices(data) {
+    if (data.action !== 'sell' && data.action !== 'remove') return;
+    await Promise.all((data.products || []).map(async (p) => {
+        if (p.price || !p.name) return;
+        const existing = await findProduct(p.name);
+        if (existing) p.price = existing.price;
+    }));
+}
+
+// Product by exact name (case-insensitive): loaded lists first, then the server
+async function findProduct(name) {
+    const wanted = name.trim().toLowerCase();
+    const loaded = (window.currentProducts || []).concat(window.salesStock || []);
+    const local = loaded.find(item => item.name.toLowerCase() === wanted);
+    if (local) return local;
+    try {
+        // Prefix search: a few rows in case longer names share the prefix
+        const res = await authFetch(`${API_URL}/products?${new URLSearchParams({ q: name.trim(), limit: 10 })}`);
+        if (!res.ok) return null;
+        return (await res.json()).find(item => item.name.toLowerCase() === wanted) || null;
+    } catch (err) {
+        console.error("Error looking up product:", err);
+        return null;
+    }
+}
+
 function showConfirmModal(data) {
     hideLoadingModal();
 
@@ -570,14 +719,6 @@ function showConfirmModal(data) {
     }
 
     products.forEach((p, index) => {
-        // Auto-lookup price if it's a sale and price is missing/0
-        if ((action === 'sell' || action === 'remove') && (!p.price || p.price === 0)) {
-            const existing = window.currentProducts ? window.currentProducts.find(item => item.name.toLowerCase() === p.name.toLowerCase()) : null;
-            if (existing) {
-                p.price = existing.price;
-            }
-        }
-
         const subtotal = (p.price || 0) * (p.quantity || 0);
 
         productsHTML += `
@@ -683,13 +824,19 @@ async function confirmCommand() {
     hideConfirmModal();
     showLoadingModal();
 
+    // Also the op_id if the operation ends up queued: the server knows it if the request got through
+    const idempotencyKey = newIdempotencyKey();
+
     try {
+        if (!navigator.onLine) throw new TypeError('Offline');
+
         const endpoint = isSale ? `${API_URL}/sales/confirm` : `${API_URL}/products/add-multiple`;
 
-        const response = await authFetch(endpoint, {
+        const response = await idempotentFetch(endpoint, {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Idempotency-Key': idempotencyKey
             },
             body: JSON.stringify(products)
         });
@@ -704,9 +851,11 @@ async function confirmCommand() {
                 showToast(`✅ ${products.length} produit(s) traité(s) !`);
             }
 
-            // Refresh everything
-            fetchProducts();
-            fetchSalesHistory();
+            // Live updates patch the lists; refresh only without them
+            if (!liveUpdates) {
+                fetchProducts();
+                fetchSalesHistory();
+            }
         } else {
             const error = await response.json();
             showToast(`❌ Erreur: ${error.detail || "Action impossible"}`);
@@ -714,13 +863,109 @@ async function confirmCommand() {
     } catch (err) {
         hideLoadingModal();
         console.error(err);
-        showToast("❌ Erreur de connexion");
+        if (err instanceof TypeError) {
+            // Network failure: keep the operation for the next sync
+            await queueOfflineOperation(isSale ? 'sale' : 'add', products, idempotencyKey);
+        } else {
+            showToast("❌ Erreur de connexion");
+        }
     }
 
     if (isActivated) micBtn.style.display = 'flex';
     pendingCommand = null;
 }
 
+// ========================
+// OFFLINE QUEUE (IndexedDB)
+// ========================
+// Operations confirmed without network are stored in order and sent in
+// one POST /sync request once the connection is back.
+const QUEUE_DB = 'stockalert_offline';
+const QUEUE_STORE = 'operations';
+const SYNC_BATCH_SIZE = 500;
+let syncing = false;
+
+function openQueueDb() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(QUEUE_DB, 1);
+        request.onupgradeneeded = () => {
+            request.result.createObjectStore(QUEUE_STORE, { keyPath: 'seq', autoIncrement: true });
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+// Run `fn(store)` in a transaction; resolves with the result of the request it returns
+async function queueTransaction(mode, fn) {
+    const db = await openQueueDb();
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(QUEUE_STORE, mode);
+        const request = fn(tx.objectStore(QUEUE_STORE));
+        tx.oncomplete = () => { db.close(); resolve(request ? request.result : undefined); };
+        tx.onerror = () => { db.close(); reject(tx.error); };
+    });
+}
+
+async function queueOfflineOperation(type, products, opId = newIdempotencyKey()) {
+    if (!window.indexedDB) {
+        showToast("❌ Erreur de connexion");
+        return;
+    }
+    try {
+        await queueTransaction('readwrite', store => store.add({
+            op_id: opId,
+            type,
+            client_timestamp: new Date().toISOString(),
+            products
+        }));
+        showToast("📴 Hors ligne : opération enregistrée, elle sera synchronisée.");
+    } catch (err) {
+        console.error("[Offline] Could not queue operation:", err);
+        showToast("❌ Erreur de connexion");
+    }
+}
+
+async function syncOfflineQueue() {
+    if (syncing || !navigator.onLine || !window.indexedDB) return;
+    syncing = true;
+    try {
+        const queued = await queueTransaction('readonly', store => store.getAll());
+        if (queued.length === 0) return;
+
+        let failed = 0;
+        for (let i = 0; i < queued.length; i += SYNC_BATCH_SIZE) {
+            const batch = queued.slice(i, i + SYNC_BATCH_SIZE);
+            const response = await authFetch(`${API_URL}/sync`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ operations: batch.map(({ seq, ...op }) => op) })
+            });
+            if (!response.ok) throw new Error(`Sync failed: ${response.status}`);
+
+            const data = await response.json();
+            failed += data.results.filter(r => r.status === 'failed').length;
+            // Applied or failed, possibly before (duplicate): the server has handled them all
+            await queueTransaction('readwrite', store => {
+                batch.forEach(op => store.delete(op.seq));
+                return null;
+            });
+        }
+
+        showToast(failed
+            ? `⚠️ Synchronisé : ${failed} opération(s) refusée(s)`
+            : `✅ ${queued.length} opération(s) hors ligne synchronisée(s)`);
+        if (!liveUpdates) {
+            fetchProducts();
+            fetchSalesHistory();
+        }
+    } catch (err) {
+        console.error("[Sync] Error:", err);
+    } finally {
+        syncing = false;
+    }
+}
+
 // ========================
 // UI HELPERS
 // ========================
@@ -1,8 +1,15 @@
 import unittest
+from unittest.mock import Mock, patch
+import msgpack
 from fastapi.testclient import TestClient
-from main import app
 import database
 import os
+import sqlite3
+
+# main.py initialises the database on import: keep it out of the working tree
+database.DB_NAME = "test_api_inventory.db"
+from main import app
+from core.idempotency import idempotency
 
 class TestAPI(unittest.TestCase):
     def setUp(self):
@@ -13,6 +20,7 @@ class TestAPI(unittest.TestCase):
         self.headers = {"X-User-ID": "test_api_user"}
 
     def tearDown(self):
+        idempotency._entries.clear()
         if os.path.exists(self.test_db):
             os.remove(self.test_db)
 
@@ -46,5 +54,182 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json()["total_amount"], 2000)
 
+    def test_get_products_paginated(self):
+        self.client.post("/products/add-multiple", json=[
+            {"name": name, "price": 100, "quantity": qty}
+            for name, qty in [("Ail", 1), ("Beurre", 8), ("Café", 3)]
+        ], headers=self.headers)
+
+        response = self.client.get("/products", params={"sort": "name", "limit": 2}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p["name"] for p in response.json()], ["Ail", "Beurre"])
+        cursor = response.headers["X-Next-Cursor"]
+
+        response = self.client.get("/products", params={"sort": "name", "limit": 2, "cursor": cursor}, headers=self.headers)
+        self.assertEqual([p["name"] for p in response.json()], ["Café"])
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+        response = self.client.get("/products", params={"q": "caf", "low_stock": "true"}, headers=self.headers)
+        self.assertEqual([p["name"] for p in response.json()], ["Café"])
+
+        response = self.client.get("/products", params={"sort": "secret"}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_alerts_endpoint(self):
+        self.client.post("/products/add-multiple", json=[
+            {"name": "Sucre", "price": 700, "quantity": 12, "min_stock": 10}
+        ], headers=self.headers)
+        self.assertEqual(self.client.get("/alerts", headers=self.headers).json(), [])
+
+        self.client.post("/sales/confirm", json=[{"name": "sucre", "quantity": 5}], headers=self.headers)
+        alerts = self.client.get("/alerts", headers=self.headers).json()
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(alerts[0]["product_name"], "Sucre")
+        self.assertEqual(alerts[0]["quantity"], 7)
+
+        response = self.client.put("/products/threshold", json={"name": "sucre", "min_stock": 5}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["min_stock"], 5)
+        self.assertEqual(self.client.get("/alerts", headers=self.headers).json(), [])
+
+        response = self.client.put("/categories/threshold", json={"category": "inconnue", "min_stock": 5}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_idempotent_sale_replay(self):
+        self.client.post("/products/add-multiple", json=[{"name": "Thé", "price": 250, "quantity": 10}], headers=self.headers)
+        headers = dict(self.headers, **{"Idempotency-Key": "sale-1"})
+        sale = [{"name": "thé", "quantity": 4}]
+
+        first = self.client.post("/sales/confirm", json=sale, headers=headers)
+        retry = self.client.post("/sales/confirm", json=sale, headers=headers)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertNotIn("Idempotent-Replayed", first.headers)
+
+        # Replayed from SQLite after a restart
+        idempotency._entries.clear()
+        retry = self.client.post("/sales/confirm", json=sale, headers=headers)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(len(self.client.get("/sales", headers=self.headers).json()), 1)
+
+        response = self.client.post("/sales/confirm", json=[{"name": "thé", "quantity": 5}], headers=headers)
+        self.assertEqual(response.status_code, 422)
+
+    def test_idempotent_error_replay(self):
+        headers = dict(self.headers, **{"Idempotency-Key": "sale-2"})
+        response = self.client.post("/sales/confirm", json=[{"name": "Mil", "quantity": 1}], headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+        # The stored failure is replayed even though the product now exists
+        self.client.post("/products/add-multiple", json=[{"name": "Mil", "price": 100, "quantity": 10}], headers=self.headers)
+        retry = self.client.post("/sales/confirm", json=[{"name": "Mil", "quantity": 1}], headers=headers)
+        self.assertEqual(retry.status_code, 400)
+        self.assertEqual(retry.json(), response.json())
+
+    def test_database_error_is_not_stored(self):
+        self.client.post("/products/add-multiple", json=[{"name": "Mil", "price": 100, "quantity": 10}], headers=self.headers)
+        headers = dict(self.headers, **{"Idempotency-Key": "sale-3"})
+        client = TestClient(app, raise_server_exceptions=False)
+        locked = sqlite3.OperationalError("database is locked")
+        with patch("database._apply_sale", side_effect=locked), \
+                patch.dict(database._BATCH_OPERATIONS, {"sale": Mock(side_effect=locked)}):
+            response = client.post("/sales/confirm", json=[{"name": "mil", "quantity": 1}], headers=headers)
+        self.assertEqual(response.status_code, 500)
+        self.assertIsNone(database.get_idempotency_record("test_api_user", "sale-3", 3600))
+
+        retry = self.client.post("/sales/confirm", json=[{"name": "mil", "quantity": 1}], headers=headers)
+        self.assertEqual(retry.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", retry.headers)
+
+    @patch("main.parse_intent", return_value={"action": "add", "products": [{"name": "Riz", "quantity": 2}]})
+    @patch("main.transcribe_audio", return_value="Ajoute 2 riz")
+    def test_idempotent_audio_command(self, transcribe, parse):
+        headers = dict(self.headers, **{"Idempotency-Key": "audio-1"})
+        files = {"file": ("command.webm", b"fake-audio", "audio/webm")}
+
+        first = self.client.post("/command/audio", files=files, headers=headers)
+        retry = self.client.post("/command/audio", files={"file": ("retry.webm", b"fake-audio", "audio/webm")}, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(transcribe.call_count, 1)
+
+        response = self.client.post("/command/audio", files={"file": ("other.webm", b"other-audio", "audio/webm")}, headers=headers)
+        self.assertEqual(response.status_code, 422)
+
+    def test_products_encodings(self):
+        self.client.post("/products/add-multiple", json=[
+            {"name": f"Produit {i}", "price": 100, "quantity": i, "description": "x" * 50} for i in range(30)
+        ], headers=self.headers)
+
+        response = self.client.get("/products", headers=dict(self.headers, **{"Accept-Encoding": "gzip"}))
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        products = response.json()
+        self.assertEqual(len(products), 30)
+        self.assertEqual(products[0], {
+            "id": 1, "name": "Produit 0", "category": "autres", "unit": "Unité", "price": 100.0,
+            "quantity": 0, "barcode": None, "description": "x" * 50, "total_value": 0.0, "min_stock": None
+        })
+
+        response = self.client.get("/products", headers=dict(self.headers, **{"Accept-Encoding": "identity"}))
+        self.assertNotIn("Content-Encoding", response.headers)
+
+        response = self.client.get("/products", headers=dict(self.headers, Accept="application/msgpack"))
+        self.assertEqual(response.headers["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content), products)
+
+    def test_sales_history_items(self):
+        self.client.post("/products/add-multiple", json=[
+            {"name": "Riz", "price": 1000, "quantity": 10}, {"name": "Sel", "price": 100, "quantity": 10}
+        ], headers=self.headers)
+        self.client.post("/sales/confirm", json=[{"name": "riz", "quantity": 1}, {"name": "sel", "quantity": 2}], headers=self.headers)
+        self.client.post("/sales/confirm", json=[{"name": "sel", "quantity": 1}], headers=self.headers)
+
+        sales = self.client.get("/sales", headers=self.headers).json()
+        self.assertEqual(sorted(len(s["items"]) for s in sales), [1, 2])
+        for sale in sales:
+            self.assertTrue(all(item["sale_id"] == sale["id"] for item in sale["items"]))
+
+    def test_sync_endpoint(self):
+        operations = [
+            {"op_id": "a1", "type": "add", "client_timestamp": "2026-10-18T09:00:00",
+             "products": [{"name": "Oignon", "price": 300, "quantity": 10}]},
+            {"op_id": "s1", "type": "sale", "client_timestamp": "2026-10-18T09:05:00",
+             "products": [{"name": "oignon", "quantity": 3}]},
+        ]
+        response = self.client.post("/sync", json={"operations": operations}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([r["status"] for r in body["results"]], ["applied", "applied"])
+        self.assertEqual(body["results"][1]["result"], {"total_amount": 900})
+        self.assertEqual(self.client.get("/sales", headers=self.headers).json()[0]["date"], "2026-10-18 09:05:00")
+
+        retry = self.client.post("/sync", json={"operations": operations}, headers=self.headers).json()
+        self.assertEqual([(r["status"], r["duplicate"]) for r in retry["results"]], [("applied", True), ("applied", True)])
+        self.assertEqual(retry["inventory_version"], body["inventory_version"])
+        self.assertEqual(self.client.get("/products", headers=self.headers).json()[0]["quantity"], 7)
+
+        response = self.client.post("/sync", json={"operations": [{"op_id": "x", "type": "sale", "client_timestamp": "2026-10-18T09:05:00", "products": []}]}, headers=self.headers)
+        self.assertEqual(response.status_code, 422)
+
+    def test_sync_skips_operations_already_sent_with_their_key(self):
+        self.client.post("/products/add-multiple", json=[{"name": "Thé", "price": 250, "quantity": 10}], headers=self.headers)
+        # The response of these requests was lost: the client queued them with the same key
+        for key, quantity in [("sale-ok", 4), ("sale-refused", 50)]:
+            self.client.post("/sales/confirm", json=[{"name": "thé", "quantity": quantity}],
+                             headers=dict(self.headers, **{"Idempotency-Key": key}))
+        operations = [
+            {"op_id": key, "type": "sale", "client_timestamp": "2026-10-18T09:05:00",
+             "products": [{"name": "thé", "quantity": quantity}]}
+            for key, quantity in [("sale-ok", 4), ("sale-refused", 50)]
+        ]
+
+        for _ in range(2):
+            results = self.client.post("/sync", json={"operations": operations}, headers=self.headers).json()["results"]
+            self.assertEqual([(r["status"], r["duplicate"]) for r in results], [("applied", True), ("failed", True)])
+            self.assertEqual(results[0]["result"], {"total_amount": 1000})
+        self.assertEqual(len(self.client.get("/sales", headers=self.headers).json()), 1)
+        self.assertEqual(self.client.get("/products", headers=self.headers).json()[0]["quantity"], 6)
+
 if __name__ == "__main__":
     unittest.main()
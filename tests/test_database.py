@@ -1,7 +1,11 @@
 import os
 import unittest
 import sqlite3
-from database import init_db, add_product, remove_product, record_sale, get_all_products, get_product
+from database import (
+    init_db, add_product, remove_product, record_sale, get_all_products, get_product,
+    get_open_alerts, set_product_threshold, set_category_threshold,
+    apply_sync, get_inventory_stats, get_sales_history
+)
 import database
 
 class TestDatabase(unittest.TestCase):
@@ -61,5 +65,191 @@ class TestDatabase(unittest.TestCase):
         self.assertFalse(success)
         self.assertIn("Stock insuffisant", message)
 
+    def test_search_products(self):
+        add_product(self.user_id, "Riz Parfumé", 1000, 10, barcode="6111234")
+        add_product(self.user_id, "Huile", 1500, 3, description="Huile de riz")
+        add_product(self.user_id, "Savon", 300, 50)
+
+        names = [p.name for p in get_all_products(self.user_id, search="parfume")]
+        self.assertEqual(names, ["Riz Parfumé"])
+        names = [p.name for p in get_all_products(self.user_id, search="611")]
+        self.assertEqual(names, ["Riz Parfumé"])
+        names = sorted(p.name for p in get_all_products(self.user_id, search="ri"))
+        self.assertEqual(names, ["Huile", "Riz Parfumé"])
+
+        # Renamed products are re-indexed by the triggers
+        conn = sqlite3.connect(self.test_db)
+        conn.execute("UPDATE products SET name = 'Savon noir' WHERE name = 'Savon'")
+        conn.commit()
+        conn.close()
+        names = [p.name for p in get_all_products(self.user_id, search="noir")]
+        self.assertEqual(names, ["Savon noir"])
+
+    def test_filter_products(self):
+        add_product(self.user_id, "Riz", 1000, 10, "alimentation", "Sac")
+        add_product(self.user_id, "Lait", 500, 2, "alimentation", "Litre")
+        add_product(self.user_id, "Pagne", 5000, 1, "vêtements")
+
+        names = [p.name for p in get_all_products(self.user_id, category="alimentation")]
+        self.assertEqual(names, ["Riz", "Lait"])
+        names = [p.name for p in get_all_products(self.user_id, unit="Litre")]
+        self.assertEqual(names, ["Lait"])
+        names = [p.name for p in get_all_products(self.user_id, low_stock=True, sort="name")]
+        self.assertEqual(names, ["Lait", "Pagne"])
+
+    def test_keyset_pagination(self):
+        for i in range(7):
+            add_product(self.user_id, f"Produit {i}", 100 * (i % 3), i)
+
+        for sort in ["id", "name", "-price", "quantity"]:
+            expected = [p.id for p in get_all_products(self.user_id, sort=sort)]
+            seen, cursor = [], None
+            while True:
+                page = get_all_products(self.user_id, sort=sort, limit=3, after=cursor)
+                seen.extend(p.id for p in page)
+                if len(page) < 3:
+                    break
+                cursor = database.encode_cursor(page[-1], sort)
+            self.assertEqual(seen, expected, sort)
+
+        with self.assertRaises(ValueError):
+            get_all_products(self.user_id, sort="password")
+        with self.assertRaises(ValueError):
+            get_all_products(self.user_id, after="not-a-cursor")
+
+    def test_every_sort_key_has_a_keyset_index(self):
+        conn = sqlite3.connect(self.test_db)
+        indexes = set()
+        for index in conn.execute("PRAGMA index_list(products)").fetchall():
+            columns = [row[2] for row in conn.execute(f"PRAGMA index_info({index[1]})")]
+            indexes.add(tuple(columns))
+        conn.close()
+        for sort, column in database.SORT_COLUMNS.items():
+            if sort != "id":
+                self.assertIn(("user_id", column.split()[0], "id"), indexes, sort)
+
+    def test_low_stock_alert_hysteresis(self):
+        add_product(self.user_id, "Farine", 400, 20, min_stock=10)
+        self.assertEqual(get_open_alerts(self.user_id), [])
+
+        record_sale(self.user_id, [{"name": "farine", "quantity": 11}])
+        alerts = get_open_alerts(self.user_id)
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual((alerts[0].product_name, alerts[0].quantity, alerts[0].threshold), ("Farine", 9, 10))
+
+        # Hovering around the threshold keeps a single alert up to date
+        add_product(self.user_id, "Farine", 0, 1)
+        remove_product(self.user_id, "Farine", 2)
+        add_product(self.user_id, "Farine", 0, 2)
+        alerts = get_open_alerts(self.user_id)
+        self.assertEqual(len(alerts), 1)
+        self.assertEqual(alerts[0].quantity, 10)
+
+        # Resolved once back above threshold + 20%
+        add_product(self.user_id, "Farine", 0, 2)
+        self.assertEqual(get_open_alerts(self.user_id), [])
+
+        # A new crossing opens a new alert
+        remove_product(self.user_id, "Farine", 5)
+        self.assertEqual(len(get_open_alerts(self.user_id)), 1)
+
+    def test_category_and_product_thresholds(self):
+        add_product(self.user_id, "Tomate", 200, 8, "alimentation")
+        add_product(self.user_id, "Pagne", 5000, 8, "vêtements")
+        self.assertEqual(get_open_alerts(self.user_id), [])
+
+        set_category_threshold(self.user_id, "alimentation", 10)
+        self.assertEqual([a.product_name for a in get_open_alerts(self.user_id)], ["Tomate"])
+        self.assertEqual([p.name for p in get_all_products(self.user_id, low_stock=True)], ["Tomate"])
+
+        # A product threshold overrides the category default
+        set_product_threshold(self.user_id, "tomate", 3)
+        self.assertEqual(get_open_alerts(self.user_id), [])
+        self.assertEqual(get_all_products(self.user_id, low_stock=True), [])
+
+        # Failed sales leave alerts untouched
+        record_sale(self.user_id, [{"name": "pagne", "quantity": 4}, {"name": "inconnu", "quantity": 1}])
+        self.assertEqual(get_open_alerts(self.user_id), [])
+
+    def test_alerts_backfilled_on_upgrade(self):
+        os.remove(self.test_db)
+        # Schema from before alerts and per-product thresholds
+        conn = sqlite3.connect(self.test_db)
+        conn.execute('''
+            CREATE TABLE products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL DEFAULT 'default',
+                name TEXT NOT NULL,
+                category TEXT DEFAULT 'autres',
+                unit TEXT DEFAULT 'Unité',
+                price REAL NOT NULL DEFAULT 0,
+                quantity INTEGER NOT NULL DEFAULT 0,
+                barcode TEXT,
+                description TEXT,
+                total_value REAL NOT NULL DEFAULT 0,
+                UNIQUE(user_id, name)
+            )
+        ''')
+        conn.executemany("INSERT INTO products (user_id, name, quantity) VALUES (?, ?, ?)",
+                         [(self.user_id, "Sel", 2), (self.user_id, "Riz", 50)])
+        conn.commit()
+        conn.close()
+
+        init_db()
+        init_db()
+        low_stock = [p.name for p in get_all_products(self.user_id, low_stock=True)]
+        self.assertEqual(low_stock, ["Sel"])
+        self.assertEqual([a.product_name for a in get_open_alerts(self.user_id)], low_stock)
+
+    def test_sync_operations_retention(self):
+        def op(op_id):
+            return {"op_id": op_id, "type": "add", "products": [dict(
+                name="Mangue", price=150, quantity=1, category="autres", unit="Unité",
+                barcode=None, description=None, min_stock=None)]}
+
+        apply_sync(self.user_id, [op("old"), op("recent")])
+        conn = sqlite3.connect(self.test_db)
+        conn.execute("UPDATE sync_operations SET synced_at = '2000-01-01 00:00:00' WHERE op_id = 'old'")
+        conn.commit()
+        conn.close()
+
+        results, _ = apply_sync(self.user_id, [op("recent"), op("old")])
+        self.assertEqual([r["duplicate"] for r in results], [True, False])
+        self.assertEqual(get_product(self.user_id, "mangue").quantity, 3)
+
+    def test_apply_sync(self):
+        def op(op_id, type, *products, date=None):
+            return {"op_id": op_id, "type": type, "date": date,
+                    "products": [dict(name=n, quantity=q, price=p, category="autres", unit="Unité",
+                                      barcode=None, description=None, min_stock=None) for n, q, p in products]}
+
+        results, version = apply_sync(self.user_id, [
+            op("op-1", "add", ("Mangue", 20, 150), ("Ananas", 5, 500)),
+            op("op-2", "sale", ("mangue", 4, 0), date="2026-10-18 08:30:00"),
+            op("op-3", "sale", ("ananas", 9, 0)),
+            op("op-4", "remove", ("mangue", 1, 0), ("papaye", 1, 0)),
+            op("op-1", "add", ("Mangue", 20, 150)),
+        ])
+
+        self.assertEqual([r["status"] for r in results], ["applied", "applied", "failed", "failed", "applied"])
+        self.assertEqual([r["duplicate"] for r in results], [False, False, False, False, True])
+        self.assertEqual(results[1]["result"], {"total_amount": 600})
+        self.assertIn("papaye", results[3]["message"])
+        self.assertEqual(get_product(self.user_id, "mangue").quantity, 16)
+        self.assertEqual(get_product(self.user_id, "ananas").quantity, 5)
+        self.assertEqual([s["date"] for s in get_sales_history(self.user_id)], ["2026-10-18 08:30:00"])
+        self.assertEqual(version, get_inventory_stats(self.user_id)["version"])
+
+        # Replaying the whole batch changes nothing
+        results, replay_version = apply_sync(self.user_id, [op("op-2", "sale", ("mangue", 4, 0)),
+                                                            op("op-3", "sale", ("ananas", 1, 0))])
+        self.assertEqual([(r["status"], r["duplicate"]) for r in results], [("applied", True), ("failed", True)])
+        self.assertEqual(results[0]["result"], {"total_amount": 600})
+        self.assertEqual(replay_version, version)
+        self.assertEqual(get_product(self.user_id, "mangue").quantity, 16)
+
+        add_product(self.user_id, "Mangue", 0, 1)
+        self.assertGreater(get_inventory_stats(self.user_id)["version"], version)
+
 if __name__ == "__main__":
     unittest.main()
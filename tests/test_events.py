@@ -0,0 +1,158 @@
+import asyncio
+import os
+import unittest
+import database
+from core.events import EventHub
+
+
+async def collect(stream, count):
+    chunks = []
+    async for chunk in stream:
+        chunks.append(chunk)
+        if len(chunks) == count:
+            break
+    await stream.aclose()
+    return chunks
+
+
+class TestEventHub(unittest.TestCase):
+    def test_publish_to_subscriber(self):
+        async def scenario():
+            hub = EventHub()
+            stream = hub.stream("shop", heartbeat=5)
+            self.assertEqual(await stream.__anext__(), "retry: 3000\n\n")
+            hub.publish("other_shop", "stock_changed", {"id": 2})
+            hub.publish("shop", "stock_changed", {"id": 1, "quantity": 4})
+            chunk = await stream.__anext__()
+            await stream.aclose()
+            return hub, chunk
+
+        hub, chunk = asyncio.run(scenario())
+        self.assertIn("event: stock_changed\n", chunk)
+        self.assertIn('data: {"id":1,"quantity":4}\n\n', chunk)
+        self.assertEqual(hub._subscribers, {})
+
+    def test_resume_from_last_event_id(self):
+        async def scenario():
+            hub = EventHub()
+            first = hub.publish("shop", "product_upserted", {"id": 1})
+            hub.publish("shop", "product_upserted", {"id": 2})
+            hub.publish("shop", "product_upserted", {"id": 3})
+            return await collect(hub.stream("shop", first["id"]), 3)
+
+        chunks = asyncio.run(scenario())
+        self.assertIn('"id":2', chunks[1])
+        self.assertIn('"id":3', chunks[2])
+
+    def test_reset_when_events_are_gone(self):
+        async def scenario():
+            hub = EventHub(buffer_size=2)
+            first = hub.publish("shop", "stock_changed", {"id": 1})
+            for i in range(3):
+                hub.publish("shop", "stock_changed", {"id": i})
+            evicted = await collect(hub.stream("shop", first["id"]), 2)
+            other_process = await collect(hub.stream("shop", "123-1"), 2)
+            return evicted, other_process
+
+        for chunks in asyncio.run(scenario()):
+            self.assertIn("event: reset\n", chunks[1])
+
+    def test_idle_buffers_are_dropped(self):
+        async def scenario():
+            hub = EventHub(buffer_idle=0)
+            stream = hub.stream("listening_shop", heartbeat=5)
+            await stream.__anext__()
+            hub.publish("listening_shop", "stock_changed", {"id": 1})
+            old = hub.publish("idle_shop", "stock_changed", {"id": 2})
+            hub.publish("idle_shop", "stock_changed", {"id": 2, "quantity": 0})
+            hub.publish("new_shop", "stock_changed", {"id": 3})
+            buffers = set(hub._buffers)
+            resumed = await collect(hub.stream("idle_shop", old["id"]), 2)
+            await stream.aclose()
+            return buffers, resumed
+
+        buffers, resumed = asyncio.run(scenario())
+        self.assertEqual(buffers, {"listening_shop", "new_shop"})
+        self.assertIn("event: reset\n", resumed[1])
+
+    def test_swept_buffer_only_resets_its_user(self):
+        async def scenario():
+            hub = EventHub(buffer_idle=0)
+            stream = hub.stream("quiet_shop", heartbeat=5)
+            await stream.__anext__()
+            quiet = hub.publish("quiet_shop", "stock_changed", {"id": 1})
+            idle_first = hub.publish("idle_shop", "stock_changed", {"id": 2})
+            idle_last = hub.publish("idle_shop", "stock_changed", {"id": 2, "quantity": 0})
+            hub.publish("other_shop", "stock_changed", {"id": 3})
+            replays = [hub.subscribe(user_id, last_id)[1] for user_id, last_id in [
+                ("quiet_shop", quiet["id"]),
+                ("idle_shop", idle_first["id"]),
+                ("idle_shop", idle_last["id"]),
+                ("idle_shop", hub.latest_id("idle_shop")),
+            ]]
+            await stream.aclose()
+            return hub, idle_last, replays
+
+        hub, idle_last, replays = asyncio.run(scenario())
+        self.assertNotIn("idle_shop", hub._buffers)
+        self.assertEqual(replays, [[], None, [], []])
+        self.assertEqual(hub.latest_id("idle_shop"), idle_last["id"])
+
+    def test_heartbeat(self):
+        async def scenario():
+            hub = EventHub()
+            return await collect(hub.stream("shop", heartbeat=0.01), 2)
+
+        self.assertEqual(asyncio.run(scenario())[1], ": ping\n\n")
+
+    def test_slow_subscriber_is_dropped(self):
+        async def scenario():
+            hub = EventHub(queue_size=2)
+            stream = hub.stream("shop", heartbeat=5)
+            await stream.__anext__()
+            for i in range(5):
+                hub.publish("shop", "stock_changed", {"id": i})
+            return [chunk async for chunk in stream], hub
+
+        chunks, hub = asyncio.run(scenario())
+        self.assertEqual(chunks, [])
+        self.assertEqual(hub._subscribers, {})
+
+
+class TestDatabaseEvents(unittest.TestCase):
+    def setUp(self):
+        self.test_db = "test_events_inventory.db"
+        database.DB_NAME = self.test_db
+        database.init_db()
+        self.events = []
+        self.listener = lambda user_id, event_type, data: self.events.append((user_id, event_type, data))
+        database.add_change_listener(self.listener)
+
+    def tearDown(self):
+        database._change_listeners.remove(self.listener)
+        if os.path.exists(self.test_db):
+            os.remove(self.test_db)
+
+    def test_mutations_emit_events(self):
+        database.add_product("shop", "Riz", 1000, 10)
+        database.remove_product("shop", "riz", 2)
+        database.record_sale("shop", [{"name": "riz", "quantity": 3}])
+        database.record_sale("shop", [{"name": "riz", "quantity": 99}])
+
+        types = [(u, t) for u, t, _ in self.events]
+        self.assertEqual(types, [
+            ("shop", "product_upserted"), ("shop", "stock_changed"),
+            ("shop", "stock_changed"), ("shop", "sale_recorded")
+        ])
+        self.assertEqual(self.events[2][2]["quantity"], 5)
+        self.assertEqual(self.events[3][2]["total_amount"], 3000)
+
+    def test_upsert_event_uses_stored_name(self):
+        database.add_product("shop", "Riz Parfumé", 1000, 10)
+        product = database.add_product("shop", "riz parfumé", 0, 5)
+        self.assertEqual(product.name, "Riz Parfumé")
+        self.assertEqual(self.events[-1][2]["name"], "Riz Parfumé")
+
+
+if __name__ == "__main__":
+    unittest.main()
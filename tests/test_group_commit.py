@@ -0,0 +1,90 @@
+import asyncio
+import os
+import unittest
+import database
+from database import init_db, add_product, get_product, apply_batch, get_open_alerts
+from core.group_commit import GroupCommitWriter
+from core.idempotency import IdempotencyStore
+
+
+class TestGroupCommit(unittest.TestCase):
+    def setUp(self):
+        self.test_db = "test_group_commit_inventory.db"
+        database.DB_NAME = self.test_db
+        init_db()
+        self.user_id = "test_user"
+
+    def tearDown(self):
+        if os.path.exists(self.test_db):
+            os.remove(self.test_db)
+
+    def test_apply_batch_isolates_failures(self):
+        add_product(self.user_id, "Riz", 1000, 10)
+        results = apply_batch([
+            ("sale", self.user_id, {"items": [{"name": "riz", "quantity": 4}]}),
+            ("sale", self.user_id, {"items": [{"name": "riz", "quantity": 1}, {"name": "sel", "quantity": 1}]}),
+            ("sale", self.user_id, {"items": [{"name": "riz", "quantity": 7}]}),
+            ("sale", self.user_id, {"items": [{"name": "riz"}]}),
+            ("remove", self.user_id, {"name": "riz", "quantity": 2}),
+            ("add", self.user_id, {"name": "Sel", "price": 100, "quantity": 3}),
+            ("remove", self.user_id, {"name": "riz", "quantity": 50}),
+        ])
+
+        self.assertEqual(results[0], (True, "Vente enregistrée", 4000))
+        self.assertEqual(results[1][:2], (False, "Produit inconnu : sel"))
+        self.assertEqual(results[2][:2], (False, "Stock insuffisant pour riz"))
+        self.assertIsInstance(results[3], KeyError)
+        self.assertEqual(results[4][0].quantity, 4)
+        self.assertEqual(results[5].name, "Sel")
+        self.assertEqual(results[6][1], "Stock insuffisant. Seulement 4 en stock.")
+        self.assertEqual(get_product(self.user_id, "riz").quantity, 4)
+        self.assertEqual(len(database.get_sales_history(self.user_id)), 1)
+        self.assertEqual([a.product_name for a in get_open_alerts(self.user_id)], ["Sel", "Riz"])
+
+    def test_idempotency_record_is_written_with_the_mutation(self):
+        add_product(self.user_id, "Riz", 1000, 10)
+
+        def sale_response(result):
+            return (200, {"total_amount": result[2]}) if result[0] else None
+
+        records = [IdempotencyStore().record(self.user_id, key, "fp", sale_response) for key in ["ok", "refused"]]
+        apply_batch([
+            ("sale", self.user_id, {"items": [{"name": "riz", "quantity": 4}], "idempotency": records[0]}),
+            ("sale", self.user_id, {"items": [{"name": "riz", "quantity": 40}], "idempotency": records[1]}),
+        ])
+
+        self.assertEqual([r["saved"] for r in records], [True, False])
+        self.assertEqual(database.get_idempotency_record(self.user_id, "ok", 3600)["response"], {"total_amount": 4000})
+        self.assertIsNone(database.get_idempotency_record(self.user_id, "refused", 3600))
+
+    def test_writer_groups_concurrent_sales(self):
+        add_product(self.user_id, "Savon", 300, 30)
+        batches = []
+        original_apply_batch = database.apply_batch
+
+        def counting_apply_batch(operations):
+            batches.append(len(operations))
+            return original_apply_batch(operations)
+
+        async def scenario():
+            writer = GroupCommitWriter(window_ms=50, max_batch=100)
+            sales = [writer.record_sale(self.user_id, [{"name": "savon", "quantity": 1}]) for _ in range(35)]
+            results = await asyncio.gather(*sales)
+            await writer.stop()
+            return results
+
+        database.apply_batch = counting_apply_batch
+        try:
+            results = asyncio.run(scenario())
+        finally:
+            database.apply_batch = original_apply_batch
+
+        self.assertEqual(sum(1 for success, _, _ in results if success), 30)
+        self.assertEqual([m for ok, m, _ in results if not ok], ["Stock insuffisant pour savon"] * 5)
+        self.assertEqual(get_product(self.user_id, "savon").quantity, 0)
+        self.assertEqual(sum(batches), 35)
+        self.assertLess(len(batches), 35)
+
+
+if __name__ == "__main__":
+    unittest.main()
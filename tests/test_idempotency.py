@@ -0,0 +1,118 @@
+import asyncio
+import os
+import unittest
+import database
+from core.idempotency import IdempotencyStore, IdempotencyConflict
+
+
+class TestIdempotencyStore(unittest.TestCase):
+    def setUp(self):
+        self.test_db = "test_idempotency_inventory.db"
+        database.DB_NAME = self.test_db
+        database.init_db()
+
+    def tearDown(self):
+        if os.path.exists(self.test_db):
+            os.remove(self.test_db)
+
+    def test_concurrent_duplicates_wait_for_first_result(self):
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 200, {"total_amount": len(calls)}
+
+        async def scenario():
+            store = IdempotencyStore()
+            return await asyncio.gather(*(store.run("shop", "k1", "fp", handler) for _ in range(5)))
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r for r, _ in results], [(200, {"total_amount": 1})] * 5)
+        self.assertEqual(sorted(replayed for _, replayed in results), [False, True, True, True, True])
+
+    def test_failed_handler_can_be_retried(self):
+        async def failing():
+            raise RuntimeError("upstream timeout")
+
+        async def succeeding():
+            return 200, {"ok": True}
+
+        async def scenario():
+            store = IdempotencyStore()
+            with self.assertRaises(RuntimeError):
+                await store.run("shop", "k1", "fp", failing)
+            return await store.run("shop", "k1", "fp", succeeding)
+
+        self.assertEqual(asyncio.run(scenario()), ((200, {"ok": True}), False))
+
+    def test_conflict_and_bounds(self):
+        async def handler():
+            return 201, {"ok": True}
+
+        async def scenario():
+            store = IdempotencyStore(max_keys=2)
+            for key in ["a", "b", "c"]:
+                await store.run("shop", key, "fp-" + key, handler)
+            with self.assertRaises(IdempotencyConflict):
+                await store.run("shop", "c", "another-payload", handler)
+            # Keys are per user
+            await store.run("other_shop", "c", "another-payload", handler)
+            return store
+
+        store = asyncio.run(scenario())
+        self.assertEqual(list(store._entries["shop"]), ["b", "c"])
+        self.assertIsNone(database.get_idempotency_record("shop", "a", 3600))
+        self.assertIsNotNone(database.get_idempotency_record("shop", "b", 3600))
+        self.assertIsNone(database.get_idempotency_record("shop", "b", -1))
+
+    def test_mutation_stores_its_own_response(self):
+        database.add_product("shop", "Riz", 1000, 10)
+        saves = []
+        original_save = database.save_idempotency_record
+
+        def sale_response(result):
+            return (200, {"total_amount": result[2]}) if result[0] else None
+
+        async def scenario():
+            store = IdempotencyStore()
+            record = store.record("shop", "k1", "fp", sale_response)
+
+            async def handler():
+                return sale_response(database.record_sale("shop", [{"name": "riz", "quantity": 2}], idempotency=record))
+
+            return await store.run("shop", "k1", "fp", handler, record)
+
+        database.save_idempotency_record = lambda *args: saves.append(args)
+        try:
+            response = asyncio.run(scenario())
+        finally:
+            database.save_idempotency_record = original_save
+        self.assertEqual(response, ((200, {"total_amount": 2000}), False))
+        self.assertEqual(saves, [])
+        self.assertEqual(database.get_idempotency_record("shop", "k1", 3600)["response"], {"total_amount": 2000})
+
+    def test_expired_keys_and_empty_users_are_dropped(self):
+        async def handler():
+            return 200, {"ok": True}
+
+        async def failing():
+            raise RuntimeError("upstream timeout")
+
+        async def scenario():
+            store = IdempotencyStore(ttl=0.01, sweep_interval=0.01)
+            await store.run("idle_shop", "a", "fp", handler)
+            await store.run("shop", "b", "fp", handler)
+            with self.assertRaises(RuntimeError):
+                await store.run("failing_shop", "c", "fp", failing)
+            await asyncio.sleep(0.02)
+            await store.run("shop", "d", "fp", handler)
+            return store
+
+        store = asyncio.run(scenario())
+        self.assertEqual({user: list(keys) for user, keys in store._entries.items()}, {"shop": ["d"]})
+
+
+if __name__ == "__main__":
+    unittest.main()